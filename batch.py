@@ -0,0 +1,369 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_all_start_methods, get_context
+from cache import cache_key, compression_params, result_params
+from deliverables import Deliverable
+from instrumentation import FileMetrics, log_event, summarize
+from limiter import DEFAULT_LOOKAHEAD, DEFAULT_RELEASE
+from pipeline import calculate_lufs, process_deliverables
+from streaming import estimate_lufs
+
+MAX_WORKERS = int(os.environ.get("LOUDV1_WORKERS", os.cpu_count() or 1))
+# Workers start from a clean process instead of being forked from a threaded
+# caller such as the web server, where a lock held by another thread at the
+# time of the fork would never be released in the child.
+POOL_CONTEXT = get_context("forkserver" if "forkserver" in get_all_start_methods() else "spawn")
+# Times a task is submitted again after its worker process died (see run_tasks).
+POOL_RETRIES = 1
+
+
+class BatchResult:
+    def __init__(self, index, status, output_path=None, original_lufs=None, processed_stats=None, cached=False, metrics=None,
+                 deliverable=None):
+        self.index = index
+        # position in the deliverables of process_batch_deliverables
+        self.deliverable = deliverable
+        self.status = status
+        self.output_path = output_path
+        self.original_lufs = original_lufs
+        # meter.LoudnessMeter.stats of the output
+        self.processed_stats = processed_stats or {}
+        self.cached = cached
+        # instrumentation.FileMetrics.as_dict of the run
+        self.metrics = metrics or {}
+
+    @property
+    def processed_lufs(self):
+        return self.processed_stats.get("integrated")
+
+
+class LoudnessResult:
+    def __init__(self, index, lufs, error_bound=None, cached=False):
+        self.index = index
+        self.lufs = lufs
+        self.error_bound = error_bound
+        self.cached = cached
+
+
+def estimate_file_lufs(input_path):
+    try:
+        return estimate_lufs(input_path)
+    except Exception as e:
+        return f"Unable to estimate LUFS: {str(e)}", None
+
+
+def file_size(path):
+    # Only orders the work; a file that cannot be read sorts last and reports
+    # the error from its worker.
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def processed_file_name(file_name, output_format, suffix=None):
+    original_name, ext = os.path.splitext(os.path.basename(file_name))
+    suffix = f"_{suffix}" if suffix else ""
+    return f"{original_name}_processed{suffix}.{output_format.lower()}"
+
+
+def output_paths_for(input_paths, output_dir, output_format, deliverables=None):
+    """Unique output paths in `output_dir`; with deliverables, one per file and deliverable, file by file."""
+    used = set()
+    output_paths = []
+    names = ((input_path, deliverable) for input_path in input_paths for deliverable in deliverables or [None])
+    for input_path, deliverable in names:
+        if deliverable is None:
+            name = processed_file_name(input_path, output_format)
+        else:
+            name = processed_file_name(input_path, deliverable.output_format, deliverable.suffix)
+        stem, ext = os.path.splitext(name)
+        counter = 2
+        while name.lower() in used:
+            name = f"{stem}_{counter}{ext}"
+            counter += 1
+        used.add(name.lower())
+        output_paths.append(os.path.join(output_dir, name))
+    return output_paths
+
+
+def intermediate_keys(cache, digest, input_path, threshold, ratio, attack, release):
+    keys = {"compressed": cache_key("compressed", digest, compression_params(threshold, ratio, attack, release))}
+    # Decoding WAV is as cheap as reading the cached copy, only other formats are worth keeping decoded.
+    if not input_path.lower().endswith(".wav"):
+        keys["decoded"] = cache_key("decoded", digest)
+    return keys
+
+
+def intermediate_paths(cache, keys):
+    # Handed out as each file is submitted, which also refreshes the last use
+    # of existing entries.
+    paths = {}
+    if cache is not None:
+        for kind, key in keys.items():
+            cache.get(key)
+            paths[kind] = os.path.join(cache.entry_dir(key), f"{kind}.npz")
+    return paths
+
+
+def store_intermediates(cache, keys, paths):
+    for kind, key in keys.items():
+        if os.path.exists(paths[kind]):
+            cache.put(key, kind, [paths[kind]])
+
+
+def cached_result(cache, index, input_path, entry, analysis_key, deliverable=None):
+    analysis = cache.get(analysis_key)
+    original_lufs = analysis["meta"]["lufs"] if analysis else None
+    metrics = FileMetrics(input_path)
+    metrics.cache["result"] = "hit"
+    return BatchResult(index, "Completed (cached)", entry["files"][0], original_lufs, entry["meta"]["stats"], cached=True,
+                       metrics=metrics.as_dict(), deliverable=deliverable)
+
+
+def process_pool(max_workers=MAX_WORKERS):
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=POOL_CONTEXT)
+
+
+def cached_task(result):
+    """A run_tasks task that is already done: it is yielded at its turn with the tag None and `result`."""
+    future = Future()
+    future.set_result(result)
+    return future, (), {}, None
+
+
+def run_tasks(tasks, max_workers=MAX_WORKERS, executor=None, replace_executor=None):
+    """Run (function, args, kwargs, tag) tasks on a process pool, yielding (tag, future) as each one finishes.
+
+    At most `max_workers` tasks are submitted at a time, so with a shared
+    `executor` (see jobs.JobManager) batches running side by side take turns
+    on its workers; without one, a pool is created for the call. Tasks that
+    have not started are cancelled if the caller stops early. `tasks` is
+    only read as workers free up, and may hold finished futures in place of
+    functions (see cached_task).
+
+    A pool whose worker process died cannot run anything again. It is
+    replaced by `replace_executor(broken)` (see
+    jobs.JobManager.replace_executor), or by a new pool for the call, and the
+    tasks that had not finished are submitted again; a task that breaks the
+    pool more than POOL_RETRIES times is yielded with its failed future.
+    """
+    if executor is None:
+        with process_pool(max_workers) as executor:
+            yield from run_tasks(tasks, max_workers, executor, replace_executor)
+        return
+    tasks = iter(tasks)
+    retries = []
+    running = {}
+    own_executors = []
+
+    def replace(broken):
+        nonlocal executor
+        print("run_tasks: A worker process died, replacing the process pool")
+        if replace_executor is not None:
+            executor = replace_executor(broken)
+        else:
+            executor = process_pool(max_workers)
+            own_executors.append(executor)
+
+    def submit(task, attempt):
+        function, args, kwargs, tag = task
+        if isinstance(function, Future):
+            running[function] = task, attempt, executor
+            return
+        try:
+            future = executor.submit(function, *args, **kwargs)
+        except BrokenProcessPool:
+            # broken by another batch sharing the pool
+            replace(executor)
+            future = executor.submit(function, *args, **kwargs)
+        running[future] = task, attempt, executor
+
+    def submit_next():
+        if retries:
+            submit(*retries.pop(0))
+            return
+        for task in tasks:
+            submit(task, 0)
+            return
+
+    try:
+        for _ in range(max_workers):
+            submit_next()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task, attempt, submitted_to = running.pop(future)
+                if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+                    if submitted_to is executor:
+                        replace(submitted_to)
+                    if attempt < POOL_RETRIES:
+                        retries.append((task, attempt + 1))
+                        submit_next()
+                        continue
+                submit_next()
+                yield task[3], future
+    finally:
+        for future in running:
+            future.cancel()
+        for own_executor in own_executors:
+            own_executor.shutdown(wait=False)
+
+
+def scan_loudness(input_paths, max_workers=MAX_WORKERS, cache=None, quick_estimate=False, executor=None, replace_executor=None):
+    """Measure the loudness of files on a process pool, yielding a LoudnessResult as each one finishes.
+
+    Exact measurements are looked up in and written to the cache's analysis
+    entries. With `quick_estimate`, streaming.estimate_lufs measures a sample
+    of each file instead and the result carries its error bound; estimates are
+    not cached. Runs on `executor` when given (see run_tasks).
+    """
+    order = sorted(range(len(input_paths)), key=lambda index: file_size(input_paths[index]), reverse=True)
+    max_workers = max(1, min(int(max_workers or 1), len(input_paths)))
+    print(f"scan_loudness: Measuring {len(input_paths)} files with {max_workers} workers")
+
+    def tasks():
+        # Each file is hashed and looked up when a worker is free for it, so
+        # results arrive while later files are still waiting to be hashed.
+        for index in order:
+            input_path = input_paths[index]
+            analysis_key = None
+            if cache is not None and not quick_estimate:
+                try:
+                    analysis_key = cache_key("analysis", cache.file_digest(input_path))
+                except OSError as e:
+                    yield cached_task(LoudnessResult(index, f"Unable to calculate LUFS: {str(e)}"))
+                    continue
+                entry = cache.get(analysis_key)
+                if entry:
+                    yield cached_task(LoudnessResult(index, entry["meta"]["lufs"], cached=True))
+                    continue
+            yield estimate_file_lufs if quick_estimate else calculate_lufs, (input_path,), {}, (index, analysis_key)
+
+    for tag, future in run_tasks(tasks(), max_workers, executor, replace_executor):
+        if tag is None:
+            yield future.result()
+            continue
+        index, analysis_key = tag
+        try:
+            result = future.result()
+        except Exception as e:
+            result = f"Unable to calculate LUFS: {str(e)}"
+        lufs, error_bound = result if quick_estimate and isinstance(result, tuple) else (result, None)
+        if analysis_key and not isinstance(lufs, str):
+            cache.put(analysis_key, "analysis", meta={"lufs": lufs})
+        yield LoudnessResult(index, lufs, error_bound)
+    if cache is not None:
+        cache.flush()
+
+
+def process_batch(input_paths, output_format, target_loudness, threshold, ratio, attack, release, peak_limit_target,
+                  limiter_lookahead=DEFAULT_LOOKAHEAD, limiter_release=DEFAULT_RELEASE, max_workers=MAX_WORKERS, cache=None, output_paths=None, measure_original=False,
+                  executor=None, replace_executor=None):
+    """Process files to one output each, yielding a BatchResult as each one finishes.
+
+    The one-deliverable case of process_batch_deliverables, with one entry of
+    `output_paths` per file; the results carry no deliverable position.
+    """
+    deliverable = Deliverable(target_loudness, peak_limit_target, output_format, limiter_lookahead, limiter_release)
+    for result in process_batch_deliverables(input_paths, [deliverable], threshold, ratio, attack, release, max_workers, cache, output_paths,
+                                             measure_original, executor, replace_executor):
+        result.deliverable = None
+        yield result
+
+
+def process_batch_deliverables(input_paths, deliverables, threshold, ratio, attack, release, max_workers=MAX_WORKERS, cache=None,
+                               output_paths=None, measure_original=False, executor=None, replace_executor=None):
+    """Process files into deliverables.Deliverable outputs on a process pool, yielding a BatchResult per file and deliverable as each file finishes.
+
+    Each worker decodes and compresses a file once for all of its
+    deliverables (see pipeline.process_deliverables). With a
+    cache.ResultCache, each file is looked up when its turn comes and its
+    results are written into the cache, so deliverables found there are not
+    rendered again; otherwise each output is written to `output_paths`, which
+    holds one path per file and deliverable, file by file (see
+    output_paths_for). Each result carries the position of its deliverable.
+    Larger files are started first, on `executor` when given (see run_tasks,
+    also for `replace_executor`). The metrics of a file are attached to its
+    first rendered deliverable only, since the work is shared; a summary of
+    them is logged when the batch is done.
+    """
+    metrics_list = []
+    order = sorted(range(len(input_paths)), key=lambda index: file_size(input_paths[index]), reverse=True)
+    max_workers = max(1, min(int(max_workers or 1), len(input_paths)))
+    print(f"process_batch: Processing {len(input_paths)} files into {len(deliverables)} deliverables with {max_workers} workers")
+
+    def tasks():
+        # As in scan_loudness, each file is hashed and looked up only when a
+        # worker is free for it.
+        for index in order:
+            input_path = input_paths[index]
+            if cache is None:
+                pending = [(number, output_paths[index * len(deliverables) + number], None) for number in range(len(deliverables))]
+                job = (index, input_path, pending, None, {})
+            else:
+                try:
+                    digest = cache.file_digest(input_path)
+                except OSError as e:
+                    metrics = FileMetrics(input_path).as_dict()
+                    yield cached_task([BatchResult(index, f"Processing failed: {str(e)}", metrics=metrics if number == 0 else None,
+                                                   deliverable=number) for number in range(len(deliverables))])
+                    continue
+                analysis_key = cache_key("analysis", digest)
+                hits = []
+                pending = []
+                for number, deliverable in enumerate(deliverables):
+                    result_key = cache_key("result", digest, result_params(deliverable.output_format, deliverable.target_loudness, threshold, ratio,
+                                                                             attack, release, deliverable.peak_limit_target,
+                                                                             deliverable.limiter_lookahead, deliverable.limiter_release))
+                    entry = cache.get(result_key)
+                    if entry:
+                        hits.append(cached_result(cache, index, input_path, entry, analysis_key, number))
+                        continue
+                    output_path = os.path.join(cache.entry_dir(result_key), processed_file_name(input_path, deliverable.output_format))
+                    pending.append((number, output_path, result_key))
+                if hits:
+                    yield cached_task(hits)
+                if not pending:
+                    continue
+                job = (index, input_path, pending, analysis_key, intermediate_keys(cache, digest, input_path, threshold, ratio, attack, release))
+            intermediates = intermediate_paths(cache, job[4])
+            args = (input_path, [deliverables[number] for number, _, _ in pending], [path for _, path, _ in pending],
+                    threshold, ratio, attack, release)
+            kwargs = dict(decoded_cache_path=intermediates.get("decoded"), compressed_cache_path=intermediates.get("compressed"),
+                          measure_original=measure_original)
+            yield process_deliverables, args, kwargs, (job, intermediates)
+
+    for tag, future in run_tasks(tasks(), max_workers, executor, replace_executor):
+        if tag is None:
+            for result in future.result():
+                if result.metrics:
+                    metrics_list.append(result.metrics)
+                yield result
+            continue
+        job, intermediates = tag
+        index, input_path, pending, analysis_key, keys = job
+        try:
+            results, original_lufs, metrics = future.result()
+        except Exception as e:
+            # Only reached if the worker process itself died, failures inside
+            # process_deliverables are already reported through its status.
+            results, original_lufs = [(f"Processing failed: {str(e)}", None, None)] * len(pending), None
+            metrics = FileMetrics(input_path).as_dict()
+        metrics_list.append(metrics)
+        if cache is not None:
+            metrics["cache"]["result"] = "miss"
+            if original_lufs is not None:
+                cache.put(analysis_key, "analysis", meta={"lufs": original_lufs})
+            store_intermediates(cache, keys, intermediates)
+        for (number, _, result_key), (status, output_file_path, processed_stats) in zip(pending, results):
+            if cache is not None and output_file_path:
+                cache.put(result_key, "result", [output_file_path], {"stats": processed_stats})
+            yield BatchResult(index, status, output_file_path, original_lufs, processed_stats,
+                              metrics=metrics if number == pending[0][0] else None, deliverable=number)
+
+    if cache is not None:
+        evicted = cache.evict()
+        print(f"process_batch: {evicted} cache entries evicted")
+    log_event("batch", **summarize(metrics_list))
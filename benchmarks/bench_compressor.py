@@ -0,0 +1,84 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from pydub import AudioSegment
+from pydub.effects import compress_dynamic_range as pydub_compress_dynamic_range
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from compressor import PYDUB_TOLERANCE_DB, compress_dynamic_range  # noqa: E402
+
+
+def make_test_signal(seconds, frame_rate, channels, seed=0):
+    # Speech-like bursts: noise-modulated tones with a syllable-rate envelope.
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * frame_rate)) / frame_rate
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3.0 * t) ** 2
+    envelope *= rng.uniform(0.05, 1.0, size=int(seconds * 4) + 1)[(t * 4).astype(int)]
+    data = np.empty((len(t), channels), dtype=np.float32)
+    for channel in range(channels):
+        tone = np.sin(2 * np.pi * (220.0 + 110.0 * channel) * t) + 0.3 * rng.standard_normal(len(t))
+        data[:, channel] = 0.5 * envelope * tone / np.max(np.abs(tone))
+    return data
+
+
+def to_segment(data, frame_rate):
+    pcm = np.clip(np.round(data * 2**15), -2**15, 2**15 - 1).astype("<i2")
+    return AudioSegment(data=pcm.tobytes(), sample_width=2, frame_rate=frame_rate, channels=data.shape[1])
+
+
+def to_float(segment):
+    pcm = np.frombuffer(segment.raw_data, dtype="<i2").reshape(-1, segment.channels)
+    return pcm.astype(np.float32) / 2**15
+
+
+def gain_error_db(reference, candidate):
+    # Compare the applied gain rather than raw samples so the error is in dB.
+    energy_ref = np.sqrt(np.mean(reference.astype(np.float64) ** 2, axis=1))
+    energy_new = np.sqrt(np.mean(candidate.astype(np.float64) ** 2, axis=1))
+    audible = energy_ref > 1e-2
+    return np.abs(20 * np.log10(energy_new[audible] / energy_ref[audible]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the NumPy compressor with pydub's compress_dynamic_range.")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--frame-rate", type=int, default=44100)
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--threshold", type=float, default=-20.0)
+    parser.add_argument("--ratio", type=float, default=2.0)
+    parser.add_argument("--attack", type=float, default=5.0)
+    parser.add_argument("--release", type=float, default=50.0)
+    parser.add_argument("--long-seconds", type=float, default=600.0,
+                        help="Length of the NumPy-only throughput run.")
+    args = parser.parse_args()
+
+    data = make_test_signal(args.seconds, args.frame_rate, args.channels)
+    segment = to_segment(data, args.frame_rate)
+    params = dict(threshold=args.threshold, ratio=args.ratio, attack=args.attack, release=args.release)
+
+    start = time.perf_counter()
+    reference = to_float(pydub_compress_dynamic_range(segment, **params))
+    pydub_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    candidate = compress_dynamic_range(to_float(segment), args.frame_rate, **params)
+    numpy_time = time.perf_counter() - start
+
+    error = gain_error_db(reference, candidate)
+    print(f"pydub: {pydub_time:.2f}s  numpy: {numpy_time:.3f}s  speedup: {pydub_time / numpy_time:.0f}x")
+    print(f"gain error: max {error.max():.4f} dB, mean {error.mean():.4f} dB (tolerance {PYDUB_TOLERANCE_DB} dB)")
+
+    long_data = make_test_signal(args.long_seconds, args.frame_rate, args.channels, seed=1)
+    start = time.perf_counter()
+    compress_dynamic_range(long_data, args.frame_rate, out=long_data, **params)
+    long_time = time.perf_counter() - start
+    print(f"numpy on {args.long_seconds:.0f}s: {long_time:.2f}s ({args.long_seconds / long_time:.0f}x realtime)")
+
+    return 0 if error.max() <= PYDUB_TOLERANCE_DB else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from pydub import AudioSegment
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pcm import float_to_pcm, pcm_to_float  # noqa: E402
+
+SAMPLE_WIDTHS = (1, 2, 3, 4)
+
+
+def legacy_to_float(segment):
+    # What the pipeline did before pcm.py: a copy through array.array, a
+    # float64 division and a float32 copy.
+    samples = np.array(segment.get_array_of_samples())
+    return (samples / 2 ** (8 * segment.sample_width - 1)).astype(np.float32)
+
+
+def legacy_to_pcm(samples, sample_width):
+    scale = 2 ** (8 * sample_width - 1)
+    dtype = np.int8 if sample_width == 1 else f"<i{sample_width}"
+    return np.clip(np.round(samples * scale), -scale, scale - 1).astype(dtype).tobytes()
+
+
+def measure(function, *args, repeat=3):
+    """Best wall time of `repeat` runs and the peak memory allocated by one run."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+        del result
+    tracemalloc.start()
+    result = function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time PCM <-> float32 conversion per sample width.")
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--frame-rate", type=int, default=48000)
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    frames = int(args.seconds * args.frame_rate)
+    float_bytes = frames * args.channels * 4
+    print(f"{args.seconds:.0f}s, {args.channels} channels, {args.frame_rate} Hz; memory is the peak allocated per conversion "
+          f"relative to the float32 buffer ({float_bytes / 2**20:.0f} MB)")
+    print(f"{'width':>5} {'direction':>12} {'legacy ms':>10} {'pcm.py ms':>10} {'speedup':>8} {'legacy mem':>11} {'pcm.py mem':>11}")
+    for sample_width in SAMPLE_WIDTHS:
+        raw = rng.integers(0, 256, size=frames * args.channels * sample_width, dtype=np.uint8).tobytes()
+        # pydub keeps 8-bit audio signed, so both paths read the bytes as signed
+        segment = AudioSegment(data=raw, sample_width=sample_width, frame_rate=args.frame_rate, channels=args.channels)
+        rows = [("to float32", (legacy_to_float, segment),
+                 (pcm_to_float, raw, sample_width, args.channels, False, True))]
+        samples = pcm_to_float(raw, sample_width, args.channels, signed_8bit=True)
+        # pydub widens 24-bit audio to 32-bit, so the old path exported 32-bit PCM
+        rows.append(("to PCM", (legacy_to_pcm, samples, segment.sample_width), (float_to_pcm, samples, sample_width)))
+        for direction, legacy, current in rows:
+            legacy_time, legacy_peak = measure(*legacy, repeat=args.repeat)
+            current_time, current_peak = measure(*current, repeat=args.repeat)
+            print(f"{sample_width * 8:>4}b {direction:>12} {legacy_time * 1000:>10.1f} {current_time * 1000:>10.1f} "
+                  f"{legacy_time / current_time:>7.1f}x {legacy_peak / float_bytes:>10.2f}x {current_peak / float_bytes:>10.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
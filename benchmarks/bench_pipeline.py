@@ -0,0 +1,309 @@
+"""Benchmark and regression harness for the processing pipeline.
+
+Generates synthetic test files, times every pipeline stage on each of them in
+a fresh worker process, once per processing profile, and reports the realtime factor (seconds of audio per
+second of processing) and peak RSS. Loudness is checked against pyloudnorm so
+a speedup cannot quietly change the measured LUFS.
+
+    python benchmarks/bench_pipeline.py --save benchmarks/baseline.json
+    python benchmarks/bench_pipeline.py --compare benchmarks/baseline.json
+
+--compare exits non-zero when a stage got slower or peak RSS grew beyond the
+tolerance, or when loudness drifted from the reference. Timings are only
+comparable on the same, otherwise idle machine. Long durations
+(--durations 10,600,10800) write large files (a 3 h 5.1 32-bit file is about
+12 GB); keep them with --work-dir so they are generated only once.
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pyloudnorm as pyln
+import scipy.io.wavfile
+import scipy.signal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pipeline  # noqa: E402
+from streaming import STREAM_BLOCK_SECONDS  # noqa: E402
+from wavfile import WavWriter  # noqa: E402
+
+SIGNALS = ("sweep", "pink", "speech")
+LAYOUTS = {"mono": 1, "stereo": 2, "5.1": 6}
+SAMPLE_WIDTHS = (1, 2, 3, 4)
+DEFAULT_DURATIONS = (10.0, 60.0)
+SWEEP_SECONDS = 10.0
+SWEEP_LOW_HZ = 20.0
+SWEEP_HIGH_HZ = 20000.0
+# Paul Kellet's economy pink noise filter (-3 dB/octave above ~10 Hz).
+PINK_B = [0.049922035, -0.095993537, 0.050612699, -0.004408786]
+PINK_A = [1.0, -2.494956002, 2.017265875, -0.522189400]
+# Syllable rate of the speech-like bursts and the length of each burst level.
+SPEECH_RATE_HZ = 3.0
+SPEECH_SEGMENT_SECONDS = 0.25
+# Cases longer than this are not checked against pyloudnorm, which needs the
+# whole signal in memory as float64.
+ACCURACY_MAX_SECONDS = 600.0
+ACCURACY_TOLERANCE_LU = 0.01
+# Stage times below this are too noisy to flag as regressions.
+MIN_REGRESSION_SECONDS = 0.1
+# The limiter only runs when the gain pushes the true peak over the ceiling,
+# so "normalize" (gain only) never reaches it; "limit" is loud enough for
+# every signal, the low-crest sweep in 5.1 included, to time the limiter and
+# its make-up passes.
+PROFILES = {
+    "normalize": {"target_loudness": -16.0, "threshold": -20.0, "ratio": 2.0, "attack": 5.0, "release": 50.0,
+                  "peak_limit_target": -1.0},
+    "limit": {"target_loudness": -9.0, "threshold": -20.0, "ratio": 2.0, "attack": 5.0, "release": 50.0,
+              "peak_limit_target": -10.0},
+}
+
+
+def case_name(signal, layout, sample_width, seconds, profile="normalize"):
+    # "normalize" cases keep the names of baselines saved before profiles
+    suffix = "" if profile == "normalize" else f"-{profile}"
+    return f"{signal}-{layout}-{sample_width * 8}bit-{seconds:g}s{suffix}"
+
+
+def signal_blocks(signal, seconds, frame_rate, channels, seed=0):
+    """Yield float32 (frames, channels) blocks of a synthetic test signal.
+
+    Every block is generated from the absolute time and carried filter state,
+    so signals of any length are produced in bounded memory.
+    """
+    block_frames = int(STREAM_BLOCK_SECONDS * frame_rate)
+    total_frames = int(seconds * frame_rate)
+    rng = np.random.default_rng(seed)
+    # Channels differ in level so no two are identical.
+    levels = (0.7 ** np.arange(channels)).astype(np.float32)
+    pink_state = np.zeros((len(PINK_A) - 1, channels))
+    impulse = np.zeros(1 << 16)
+    impulse[0] = 1.0
+    pink_gain = 0.25 / np.sqrt(np.sum(scipy.signal.lfilter(PINK_B, PINK_A, impulse) ** 2))
+    sweep_rate = math.log(SWEEP_HIGH_HZ / SWEEP_LOW_HZ) / SWEEP_SECONDS
+
+    for start in range(0, total_frames, block_frames):
+        t = (start + np.arange(min(block_frames, total_frames - start))) / frame_rate
+        if signal == "sweep":
+            # exponential sweep, restarted every SWEEP_SECONDS
+            phase = 2 * np.pi * SWEEP_LOW_HZ / sweep_rate * (np.exp(sweep_rate * (t % SWEEP_SECONDS)) - 1.0)
+            mono = 0.5 * np.sin(phase)
+            block = mono[:, None] * levels
+        elif signal == "pink":
+            white = rng.standard_normal((len(t), channels))
+            block, pink_state = scipy.signal.lfilter(PINK_B, PINK_A, white, axis=0, zi=pink_state)
+            block = block * pink_gain * levels
+        else:
+            # Speech-like bursts: noise-modulated tones with a syllable-rate
+            # envelope whose level changes every SPEECH_SEGMENT_SECONDS.
+            segment = (t / SPEECH_SEGMENT_SECONDS).astype(np.int64)
+            segment_levels = rng.uniform(0.05, 1.0, size=segment[-1] - segment[0] + 1)
+            envelope = (0.5 + 0.5 * np.sin(2 * np.pi * SPEECH_RATE_HZ * t) ** 2) * segment_levels[segment - segment[0]]
+            block = np.empty((len(t), channels))
+            for channel in range(channels):
+                tone = np.sin(2 * np.pi * (220.0 + 110.0 * channel) * t) + 0.3 * rng.standard_normal(len(t))
+                block[:, channel] = 0.4 * envelope * tone * levels[channel]
+        yield np.clip(block, -1.0, 1.0).astype(np.float32)
+
+
+def write_signal(path, signal, seconds, frame_rate, channels, sample_width):
+    with WavWriter(path, frame_rate, channels, sample_width) as writer:
+        for block in signal_blocks(signal, seconds, frame_rate, channels):
+            writer.write(block)
+
+
+def reference_lufs(path):
+    """Integrated loudness from pyloudnorm, reading the file with scipy."""
+    frame_rate, data = scipy.io.wavfile.read(path)
+    if data.dtype == np.uint8:
+        data = (data.astype(np.float64) - 128.0) / 128.0
+    else:
+        # scipy returns 24-bit samples left-aligned in int32
+        data = data / float(-np.iinfo(data.dtype).min)
+    if data.ndim == 1:
+        data = data[:, None]
+    if data.shape[1] == 6:
+        # pyloudnorm has no 5.1 weights; drop the LFE channel as meter.py does
+        data = data[:, [0, 1, 2, 4, 5]]
+    return pyln.Meter(frame_rate).integrated_loudness(data)
+
+
+def run_case(input_path, output_path, output_format, check_accuracy, profile="normalize"):
+    """Process one file with pipeline.process_single_audio and the settings of a profile and return its stage times.
+
+    The stages are the ones the pipeline records (see instrumentation.stage),
+    so the benchmark follows whatever the pipeline does, in memory or
+    streaming. Runs in its own worker process so the peak RSS is the case's own.
+    """
+    p = PROFILES[profile]
+    start = time.perf_counter()
+    input_lufs = pipeline.calculate_lufs(input_path)
+    stages = {"calculate_lufs": time.perf_counter() - start}
+    with contextlib.redirect_stdout(io.StringIO()):
+        status, _, _, stats, metrics = pipeline.process_single_audio(input_path, output_path, output_format, p["target_loudness"],
+                                                                     p["threshold"], p["ratio"], p["attack"], p["release"],
+                                                                     p["peak_limit_target"])
+    if not stats:
+        raise RuntimeError(f"{input_path}: {status}")
+    stages.update(metrics["stages"])
+    result = {"stages": stages, "peak_rss": metrics["peak_memory"], "input_lufs": input_lufs, "output_lufs": stats["integrated"],
+              "lufs_error": {}}
+
+    if check_accuracy:
+        # (measured, reference) of the input and of the file written, which
+        # differs from the processed buffer by the quantization noise
+        pairs = {"input": (input_lufs, reference_lufs(input_path))}
+        if output_format.lower() == "wav":
+            pairs["output"] = (pipeline.calculate_lufs(output_path), reference_lufs(output_path))
+        for key, (measured, reference) in pairs.items():
+            finite = np.isfinite(measured) and np.isfinite(reference)
+            result["lufs_error"][key] = abs(measured - reference) if finite else (0.0 if measured == reference else float("inf"))
+    os.remove(output_path)
+    return result
+
+
+def run_benchmarks(args):
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="loudv1-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+    cases = {}
+    try:
+        for seconds in args.durations:
+            for signal in args.signals:
+                for layout in args.layouts:
+                    for sample_width in args.widths:
+                        input_path = os.path.join(work_dir, f"{case_name(signal, layout, sample_width, seconds)}.wav")
+                        if not os.path.exists(input_path):
+                            write_signal(input_path, signal, seconds, args.frame_rate, LAYOUTS[layout], sample_width)
+                        for profile in args.profiles:
+                            name = case_name(signal, layout, sample_width, seconds, profile)
+                            output_path = os.path.join(work_dir, f"{name}_processed.{args.format.lower()}")
+                            check_accuracy = seconds <= ACCURACY_MAX_SECONDS
+                            best = None
+                            for _ in range(args.repeat):
+                                # A fresh process per run, so peak RSS is not inherited from earlier cases.
+                                with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                                    result = executor.submit(run_case, input_path, output_path, args.format, check_accuracy, profile).result()
+                                if best is None:
+                                    best = result
+                                else:
+                                    best["stages"] = {stage: min(best["stages"][stage], result["stages"].get(stage, best["stages"][stage]))
+                                                      for stage in best["stages"]}
+                                check_accuracy = False
+                            cases[name] = summarize(best, seconds)
+                            print_case(name, cases[name])
+                        if not args.work_dir:
+                            os.remove(input_path)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return {"frame_rate": args.frame_rate, "format": args.format, "profiles": {profile: PROFILES[profile] for profile in args.profiles},
+            "machine": platform.platform(),
+            "python": platform.python_version(), "numpy": np.__version__, "cases": cases}
+
+
+def summarize(result, seconds):
+    stages = result["stages"]
+    total = sum(stages.values())
+    case = {"duration": seconds, "stages": stages, "total": total,
+            "realtime_factor": {stage: seconds / elapsed if elapsed else None for stage, elapsed in stages.items()},
+            "total_realtime_factor": seconds / total if total else None, "peak_rss": result["peak_rss"],
+            "input_lufs": result["input_lufs"], "output_lufs": result["output_lufs"], "lufs_error": result["lufs_error"]}
+    return case
+
+
+def format_rss(rss):
+    return f"{rss / 2**20:.0f} MB" if rss is not None else "n/a"
+
+
+def print_case(name, case):
+    stages = "  ".join(f"{stage} {elapsed:.2f}s" for stage, elapsed in case["stages"].items())
+    errors = "  ".join(f"{key} {error:.4f} LU" for key, error in case["lufs_error"].items())
+    print(f"{name:>28}: {case['total']:.2f}s ({case['total_realtime_factor']:.0f}x realtime), peak RSS {format_rss(case['peak_rss'])}")
+    print(f"{'':>30}{stages}")
+    if errors:
+        print(f"{'':>30}LUFS error vs pyloudnorm: {errors}")
+
+
+def accuracy_failures(results):
+    return [f"{name}: {key} LUFS off by {error:.4f} LU (tolerance {ACCURACY_TOLERANCE_LU} LU)"
+            for name, case in results["cases"].items() for key, error in case["lufs_error"].items()
+            if error > ACCURACY_TOLERANCE_LU]
+
+
+def compare(results, baseline, tolerance, rss_tolerance):
+    """Regressions of `results` against `baseline`, as a list of messages."""
+    regressions = []
+    for name, case in results["cases"].items():
+        reference = baseline["cases"].get(name)
+        if reference is None:
+            print(f"{name}: not in the baseline")
+            continue
+        for stage, elapsed in [*case["stages"].items(), ("total", case["total"])]:
+            before = reference["total"] if stage == "total" else reference["stages"].get(stage)
+            if before is None:
+                continue
+            change = elapsed / before - 1.0 if before else 0.0
+            regressed = change > tolerance and elapsed - before > MIN_REGRESSION_SECONDS
+            print(f"{name:>28} {stage:>18}: {before:8.3f}s -> {elapsed:8.3f}s ({change:+.0%}){'  REGRESSION' if regressed else ''}")
+            if regressed:
+                regressions.append(f"{name}: {stage} {change:+.0%} slower")
+        if case["peak_rss"] and reference.get("peak_rss"):
+            change = case["peak_rss"] / reference["peak_rss"] - 1.0
+            if change > rss_tolerance:
+                regressions.append(f"{name}: peak RSS {format_rss(reference['peak_rss'])} -> {format_rss(case['peak_rss'])}")
+    return regressions
+
+
+def parse_list(value, cast=str):
+    return [cast(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the loudness pipeline stage by stage on synthetic signals.")
+    parser.add_argument("--signals", type=parse_list, default=list(SIGNALS), help=f"Comma-separated, from {', '.join(SIGNALS)}.")
+    parser.add_argument("--layouts", type=parse_list, default=list(LAYOUTS), help=f"Comma-separated, from {', '.join(LAYOUTS)}.")
+    parser.add_argument("--widths", type=lambda value: parse_list(value, int), default=list(SAMPLE_WIDTHS),
+                        help="Comma-separated sample widths in bytes (1, 2, 3, 4).")
+    parser.add_argument("--durations", type=lambda value: parse_list(value, float), default=list(DEFAULT_DURATIONS),
+                        help="Comma-separated durations in seconds, e.g. 10,600,10800.")
+    parser.add_argument("--profiles", type=parse_list, default=list(PROFILES), help=f"Comma-separated, from {', '.join(PROFILES)}.")
+    parser.add_argument("--frame-rate", type=int, default=48000)
+    parser.add_argument("--format", default="WAV", help="Output format of the export stage.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case; the fastest time of each stage is kept.")
+    parser.add_argument("--work-dir", help="Keep the generated signals here and reuse them on later runs.")
+    parser.add_argument("--save", help="Write the results to this JSON file (a baseline).")
+    parser.add_argument("--compare", help="Compare with this baseline and fail on regressions.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown per stage (0.25 = 25%%).")
+    parser.add_argument("--rss-tolerance", type=float, default=0.25, help="Allowed growth of peak RSS.")
+    args = parser.parse_args()
+    for name, allowed in (("signals", SIGNALS), ("layouts", LAYOUTS), ("profiles", PROFILES)):
+        unknown = set(getattr(args, name)) - set(allowed)
+        if unknown:
+            parser.error(f"unknown {name}: {', '.join(sorted(unknown))}")
+
+    results = run_benchmarks(args)
+    failures = accuracy_failures(results)
+    if args.compare:
+        with open(args.compare, "r") as f:
+            failures += compare(results, json.load(f), args.tolerance, args.rss_tolerance)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=4)
+        print(f"Results saved to {args.save}")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
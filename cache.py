@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+INDEX_FILE = "cache_index.json"
+# Bump when a change to the processing changes its output, so stale results
+# are not served from the cache.
+CACHE_VERSION = 5
+CACHE_MAX_BYTES = int(os.environ.get("LOUDV1_CACHE_MB", 10240)) * 1024 * 1024
+HASH_CHUNK_SIZE = 1 << 20
+# Changes to the index are written out at most this often (and by `flush`),
+# as every save rewrites the whole file.
+INDEX_FLUSH_SECONDS = 5.0
+
+
+def cache_key(*parts):
+    return hashlib.sha256(json.dumps([CACHE_VERSION, *parts]).encode("utf-8")).hexdigest()
+
+
+def link_file(source, destination):
+    """Place `source` at `destination` without copying the data where possible.
+
+    Hard links the file (falling back to a copy across filesystems or where
+    links are unsupported) under a temporary name and renames it over
+    `destination`, so an existing destination is replaced atomically.
+    """
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        # already linked; renaming a link over the same file would be a no-op
+        return destination
+    temp_path = f"{destination}.{os.getpid()}.tmp"
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
+    try:
+        os.link(source, temp_path)
+    except OSError:
+        shutil.copy2(source, temp_path)
+    os.replace(temp_path, destination)
+    return destination
+
+
+def compression_params(threshold, ratio, attack, release):
+    return [float(threshold), float(ratio), float(attack), float(release)]
+
+
+def result_params(output_format, target_loudness, threshold, ratio, attack, release, peak_limit_target, limiter_lookahead,
+                  limiter_release):
+    return [output_format.lower(), float(target_loudness), *compression_params(threshold, ratio, attack, release),
+            float(peak_limit_target), float(limiter_lookahead), float(limiter_release)]
+
+
+class ResultCache:
+    """Content-addressed cache of processing results and intermediates.
+
+    Entries live in per-key subdirectories of `directory` and are described by
+    a JSON index (kind, files, size, last use, metadata). Keys combine the
+    SHA-256 of the input file with the parameters that produced the entry.
+    When the total size exceeds `max_bytes`, least recently used entries are
+    evicted by `evict`. The index is only touched by the owning process; worker
+    processes write entry files to paths handed out by `entry_dir`. It is kept
+    in memory and saved by `flush` (called by `evict` and at the end of each
+    batch), or when a change comes INDEX_FLUSH_SECONDS after the last save.
+    """
+
+    def __init__(self, directory, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self._lock = threading.RLock()
+        self._index = self._load_index()
+        self._dirty = False
+        self._saved = time.monotonic()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+            if index.get("version") == CACHE_VERSION:
+                return index
+        except (OSError, ValueError):
+            pass
+        return {"version": CACHE_VERSION, "entries": {}, "digests": {}}
+
+    def _save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(temp_path, self.index_path)
+        self._dirty = False
+        self._saved = time.monotonic()
+
+    def _changed(self):
+        self._dirty = True
+        if time.monotonic() - self._saved >= INDEX_FLUSH_SECONDS:
+            self._save_index()
+
+    def flush(self):
+        """Write pending changes of the index to disk."""
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def file_digest(self, path):
+        """SHA-256 of the file contents, memoized by path, size and mtime."""
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        with self._lock:
+            known = self._index["digests"].get(path)
+            if known and known[:2] == signature:
+                return known[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        with self._lock:
+            self._index["digests"][path] = signature + [digest.hexdigest()]
+            self._changed()
+        return digest.hexdigest()
+
+    def entry_dir(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._index["entries"].get(key)
+            if entry is None:
+                return None
+            if not all(os.path.exists(path) for path in entry["files"]):
+                self._remove(key)
+                self._changed()
+                return None
+            entry["last_used"] = time.time()
+            self._changed()
+            return entry
+
+    def put(self, key, kind, files=(), meta=None):
+        files = [path for path in files if path]
+        size = sum(os.path.getsize(path) for path in files)
+        with self._lock:
+            self._index["entries"][key] = {"kind": kind, "files": files, "size": size,
+                                           "last_used": time.time(), "meta": meta or {}}
+            self._changed()
+
+    def _remove(self, key):
+        entry = self._index["entries"].pop(key, None)
+        if entry is None:
+            return
+        for path in entry["files"]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        with self._lock:
+            entries = sorted(self._index["entries"].items(), key=lambda item: item[1]["last_used"])
+            total = sum(entry["size"] for _, entry in entries)
+            evicted = 0
+            for key, entry in entries:
+                if total <= self.max_bytes:
+                    break
+                self._remove(key)
+                total -= entry["size"]
+                evicted += 1
+            self._index["digests"] = {path: value for path, value in self._index["digests"].items() if os.path.exists(path)}
+            self._save_index()
+            return evicted
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._index["entries"]):
+                self._remove(key)
+            self._index = {"version": CACHE_VERSION, "entries": {}, "digests": {}}
+            self._save_index()
@@ -0,0 +1,163 @@
+"""Headless batch processing without the Gradio UI.
+
+Example:
+    python cli.py "incoming/*.wav" podcasts/ --preset default --target -16 --output-dir out --report out/report.csv
+    python cli.py master.wav --output-dir out --deliverable=-14:-1:AAC --deliverable=-16:-1:WAV --deliverable=-23:-1:WAV
+"""
+import argparse
+import csv
+import glob
+import json
+import math
+import os
+import sys
+import time
+from batch import MAX_WORKERS, output_paths_for, process_batch, process_batch_deliverables
+from cache import ResultCache, link_file
+from deliverables import parse_deliverable, preset_deliverable
+from instrumentation import DEBUG, INFO, QUIET, bottleneck, configure, summarize
+from limiter import DEFAULT_LOOKAHEAD, DEFAULT_RELEASE
+from presets import PRESET_KEYS, read_preset
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".flac", ".aac", ".m4a", ".ogg", ".opus", ".wma", ".aiff", ".aif")
+DEFAULTS = {"threshold": -20.0, "ratio": 2.0, "attack": 5.0, "release": 50.0, "peak_limit_target": -3.0,
+            "limiter_lookahead": DEFAULT_LOOKAHEAD, "limiter_release": DEFAULT_RELEASE}
+# Loudness stats of the output (see meter.LoudnessMeter.stats), reported with a "processed_" prefix.
+STATS_FIELDS = ["momentary_max", "short_term_max", "lra", "sample_peak", "true_peak"]
+# Per-file instrumentation (see instrumentation.FileMetrics).
+METRICS_FIELDS = ["seconds", "realtime_factor", "peak_memory"]
+REPORT_FIELDS = ["input", "deliverable", "output", "status", "original_lufs", "processed_lufs", *[f"processed_{key}" for key in STATS_FIELDS], "cached",
+                 *METRICS_FIELDS, "stages"]
+
+
+def expand_inputs(patterns, recursive=False):
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            walker = os.walk(pattern) if recursive else [(pattern, [], os.listdir(pattern))]
+            for root, _, names in walker:
+                paths.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith(AUDIO_EXTENSIONS))
+        else:
+            matches = sorted(glob.glob(pattern, recursive=recursive))
+            paths.extend(path for path in matches if os.path.isfile(path))
+    seen = set()
+    return [path for path in paths if not (os.path.abspath(path) in seen or seen.add(os.path.abspath(path)))]
+
+
+def report_value(value):
+    # -inf and NaN (e.g. the peak of silence) are not valid JSON; they are
+    # written as null, and as empty cells in CSV.
+    return None if isinstance(value, float) and not math.isfinite(value) else value
+
+
+def write_report(report_path, rows):
+    os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+    rows = [{key: report_value(value) for key, value in row.items()} for row in rows]
+    if report_path.lower().endswith(".csv"):
+        with open(report_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows({**row, "stages": json.dumps(row["stages"])} for row in rows)
+    else:
+        with open(report_path, "w") as f:
+            json.dump(rows, f, indent=4)
+
+
+def export_from_cache(cached_path, output_path):
+    # Cache entries are never rewritten in place, so a hard link is safe.
+    return link_file(cached_path, output_path)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Normalize loudness and compress dynamic range of audio files.")
+    parser.add_argument("inputs", nargs="+", help="Audio files, glob patterns or directories.")
+    parser.add_argument("-o", "--output-dir", required=True, help="Directory for the processed files.")
+    parser.add_argument("-p", "--preset", help="Name of a preset in presets/ to take the compression and peak settings from.")
+    parser.add_argument("-f", "--format", default="WAV", choices=["WAV", "AAC", "wav", "aac"], help="Output format.")
+    parser.add_argument("-t", "--target", type=float, default=-16.0, help="Target loudness in LUFS (default: -16).")
+    parser.add_argument("--threshold", type=float, help="Compressor threshold in dBFS.")
+    parser.add_argument("--ratio", type=float, help="Compression ratio.")
+    parser.add_argument("--attack", type=float, help="Attack in ms.")
+    parser.add_argument("--release", type=float, help="Release in ms.")
+    parser.add_argument("--peak-limit", dest="peak_limit_target", type=float, help="Peak limit target (true peak) in dBFS.")
+    parser.add_argument("--limiter-lookahead", dest="limiter_lookahead", type=float, help="Peak limiter look-ahead in ms.")
+    parser.add_argument("--limiter-release", dest="limiter_release", type=float, help="Peak limiter release in ms.")
+    parser.add_argument("-d", "--deliverable", action="append", default=[], metavar="TARGET[:PEAK[:FORMAT]]",
+                        help="Render every input to this deliverable, e.g. --deliverable=-14:-1:AAC (with '=', as it starts with '-'); "
+                             "repeat for more. Each file is decoded and "
+                             "compressed once for all deliverables. Peak and format default to --peak-limit and --format.")
+    parser.add_argument("--deliverable-preset", action="append", default=[], metavar="PRESET",
+                        help="Add a deliverable from the peak, limiter, target and format settings of a preset; repeat for more.")
+    parser.add_argument("-j", "--workers", type=int, default=MAX_WORKERS, help="Number of worker processes (default: CPU count or LOUDV1_WORKERS).")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Search directories recursively and allow ** in patterns.")
+    parser.add_argument("--report", help="Write a report of the batch to this .json or .csv file.")
+    parser.add_argument("--cache-dir", help="Reuse and store results in this content-addressed cache directory.")
+    parser.add_argument("-v", "--verbose", action="count", default=QUIET,
+                        help=f"Write JSON-lines logs: -v one record per file and batch, -vv also every stage (or {INFO}/{DEBUG} in LOUDV1_LOG_LEVEL).")
+    parser.add_argument("--log-file", help="Append the JSON-lines logs to this file instead of stderr.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure(args.verbose or None, args.log_file)
+    params = dict(DEFAULTS)
+    if args.preset:
+        params.update({key: value for key, value in read_preset(args.preset).items() if key in PRESET_KEYS})
+    for key in PRESET_KEYS:
+        if getattr(args, key) is not None:
+            params[key] = getattr(args, key)
+
+    try:
+        deliverables = [parse_deliverable(spec, params["peak_limit_target"], args.format, params["limiter_lookahead"], params["limiter_release"])
+                        for spec in args.deliverable]
+        deliverables += [preset_deliverable(name, args.target, args.format) for name in args.deliverable_preset]
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Invalid deliverable: {e}", file=sys.stderr)
+        return 2
+
+    input_paths = expand_inputs(args.inputs, args.recursive)
+    if not input_paths:
+        print("No input files found.", file=sys.stderr)
+        return 2
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_paths = output_paths_for(input_paths, args.output_dir, args.format, deliverables)
+    cache = ResultCache(args.cache_dir) if args.cache_dir else None
+
+    start = time.perf_counter()
+    rows = [None] * len(output_paths)
+    metrics_list = []
+    if deliverables:
+        results = process_batch_deliverables(input_paths, deliverables, params["threshold"], params["ratio"], params["attack"], params["release"],
+                                             max_workers=args.workers, cache=cache, output_paths=output_paths, measure_original=True)
+    else:
+        results = process_batch(input_paths, args.format, args.target, params["threshold"], params["ratio"], params["attack"],
+                                params["release"], params["peak_limit_target"], params["limiter_lookahead"], params["limiter_release"],
+                                max_workers=args.workers, cache=cache,
+                                output_paths=output_paths, measure_original=True)
+    for result in results:
+        # one row per file, or per file and deliverable
+        slot = result.index if result.deliverable is None else result.index * len(deliverables) + result.deliverable
+        output_path = result.output_path
+        if cache is not None and output_path:
+            output_path = export_from_cache(output_path, output_paths[slot])
+        deliverable = deliverables[result.deliverable].label if result.deliverable is not None else None
+        rows[slot] = {"input": input_paths[result.index], "deliverable": deliverable, "output": output_path, "status": result.status,
+                      "original_lufs": result.original_lufs, "processed_lufs": result.processed_lufs,
+                      **{f"processed_{key}": result.processed_stats.get(key) for key in STATS_FIELDS}, "cached": result.cached,
+                      **{key: result.metrics.get(key) for key in METRICS_FIELDS}, "stages": result.metrics.get("stages", {})}
+        metrics_list.append(result.metrics)
+        print(f"{result.status}: {input_paths[result.index]} -> {output_path}")
+
+    failed = sum(1 for row in rows if not row["output"])
+    print(f"Processed {len(rows) - failed} of {len(rows)} files in {time.perf_counter() - start:.1f}s")
+    slowest = bottleneck(summarize(metrics_list))
+    if slowest:
+        print(f"Slowest stage: {slowest[0]} ({slowest[1]:.0%} of stage time)")
+    if args.report:
+        write_report(args.report, rows)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import numpy as np
+
+# Attack/release smoothing is stepped once per block of frames. Smaller blocks
+# track pydub's per-frame state machine more closely, larger blocks are faster;
+# by default a block is 1/ATTACK_BLOCKS of the attack time, capped at
+# MAX_BLOCK_SIZE frames.
+ATTACK_BLOCKS = 16
+MAX_BLOCK_SIZE = 64
+# Frames processed per vectorized pass, bounds the temporary arrays.
+DEFAULT_CHUNK_SIZE = 1 << 18
+# Largest per-frame gain difference to pydub.effects.compress_dynamic_range on
+# 16-bit material above -40 dBFS with the default block size; the average
+# difference is typically below 0.03 dB. Checked by benchmarks/bench_compressor.py.
+PYDUB_TOLERANCE_DB = 0.3
+
+
+class Compressor:
+    """Vectorized port of pydub.effects.compress_dynamic_range.
+
+    Works on float32 arrays shaped (frames, channels) scaled to [-1.0, 1.0].
+    The RMS envelope (trailing window of `attack` ms over all channels) and the
+    gain curve are computed for whole chunks at once; attack/release smoothing
+    is evaluated in closed form once per `block_size` frames. The envelope
+    history and the current attenuation are kept on the instance, so a long
+    signal can be fed through `process` in consecutive chunks.
+
+    Like pydub, the attenuation is only released while the signal is above the
+    threshold; it is held when the signal drops below it.
+    """
+
+    def __init__(self, frame_rate, threshold=-20.0, ratio=4.0, attack=5.0, release=50.0, block_size=None):
+        self.frame_rate = frame_rate
+        self.threshold = threshold
+        self.ratio = ratio
+        self.attack = attack
+        self.release = release
+        self.thresh_rms = 10 ** (threshold / 20.0)
+        self.look_frames = int(frame_rate * attack / 1000.0)
+        self.attack_frames = max(frame_rate * attack / 1000.0, 1.0)
+        self.release_frames = max(frame_rate * release / 1000.0, 1.0)
+        if block_size is None:
+            block_size = min(self.attack_frames // ATTACK_BLOCKS, MAX_BLOCK_SIZE)
+        self.block_size = max(1, int(block_size))
+        self.reset()
+
+    def reset(self):
+        self.attenuation = 0.0
+        self._history = np.zeros(0, dtype=np.float64)
+
+    def envelope(self, samples):
+        power = np.einsum("ij,ij->i", samples, samples, dtype=np.float64)
+        extended = np.concatenate((self._history, power))
+        offset = len(self._history)
+        cumulative = np.concatenate(([0.0], np.cumsum(extended)))
+        end = np.arange(offset, offset + len(power))
+        start = np.maximum(end - self.look_frames, 0)
+        count = (end - start) * samples.shape[1]
+        window_sum = np.maximum(cumulative[end] - cumulative[start], 0.0)
+        rms = np.sqrt(window_sum / np.maximum(count, 1))
+        self._history = extended[len(extended) - self.look_frames:].copy() if self.look_frames else extended[:0]
+        return rms
+
+    def max_attenuation(self, rms):
+        over_db = np.zeros_like(rms)
+        above = rms > self.thresh_rms
+        over_db[above] = 20 * np.log10(rms[above] / self.thresh_rms)
+        return (1 - 1.0 / self.ratio) * over_db
+
+    def attenuation_curve(self, max_attenuation):
+        frames = len(max_attenuation)
+        block = self.block_size
+        blocks = -(-frames // block)
+        padded = np.zeros(blocks * block)
+        padded[:frames] = max_attenuation
+        targets = padded.reshape(blocks, block).sum(axis=1)
+        targets[:-1] /= block
+        targets[-1] /= frames - (blocks - 1) * block
+
+        # Only the attenuation at block boundaries depends on the previous
+        # block, the per-frame ramps are filled in vectorized below.
+        starts = np.empty(blocks)
+        attenuation = self.attenuation
+        attack_frames = self.attack_frames
+        release_frames = self.release_frames
+        for i, target in enumerate(targets.tolist()):
+            starts[i] = attenuation
+            if target <= 0.0:
+                continue
+            if attenuation <= target:
+                attenuation = min(attenuation + block * target / attack_frames, target)
+            else:
+                attenuation = max(attenuation - block * target / release_frames, target)
+        self.attenuation = attenuation
+
+        steps = np.arange(1, block + 1)
+        start = starts[:, None]
+        target = targets[:, None]
+        rising = np.minimum(start + steps * (target / attack_frames), target)
+        falling = np.maximum(start - steps * (target / release_frames), target)
+        curve = np.where(start <= target, rising, falling)
+        curve = np.where(target > 0.0, curve, start)
+        return curve.reshape(-1)[:frames]
+
+    def process(self, samples, out=None):
+        if out is None:
+            out = np.empty_like(samples)
+        if len(samples) == 0:
+            return out
+        rms = self.envelope(samples)
+        attenuation = self.attenuation_curve(self.max_attenuation(rms))
+        gain = np.power(10.0, -attenuation / 20.0).astype(samples.dtype)
+        np.multiply(samples, gain[:, None], out=out)
+        return out
+
+
+def compress_dynamic_range(samples, frame_rate, threshold=-20.0, ratio=4.0, attack=5.0, release=50.0,
+                           block_size=None, chunk_size=DEFAULT_CHUNK_SIZE, out=None):
+    """Compress a whole (frames, channels) float32 array, chunk by chunk."""
+    compressor = Compressor(frame_rate, threshold, ratio, attack, release, block_size)
+    if out is None:
+        out = np.empty_like(samples)
+    chunk_size = max(compressor.block_size, chunk_size - chunk_size % compressor.block_size)
+    for start in range(0, len(samples), chunk_size):
+        end = start + chunk_size
+        compressor.process(samples[start:end], out=out[start:end])
+    return out
@@ -0,0 +1,75 @@
+import re
+from limiter import DEFAULT_LOOKAHEAD, DEFAULT_RELEASE
+from presets import read_preset
+
+OUTPUT_FORMATS = ("WAV", "AAC")
+
+
+class Deliverable:
+    """One output of a multi-deliverable run: target loudness, peak ceiling, format and limiter timing.
+
+    All deliverables of a run share its compression settings, so each file is
+    decoded and compressed once and every deliverable only adds its gain,
+    limiter and encoder (see pipeline.process_deliverables).
+    """
+
+    def __init__(self, target_loudness, peak_limit_target, output_format, limiter_lookahead=DEFAULT_LOOKAHEAD,
+                 limiter_release=DEFAULT_RELEASE, name=None):
+        self.target_loudness = float(target_loudness)
+        self.peak_limit_target = float(peak_limit_target)
+        self.output_format = str(output_format).upper()
+        self.limiter_lookahead = float(limiter_lookahead)
+        self.limiter_release = float(limiter_release)
+        self.name = name
+
+    @property
+    def label(self):
+        label = f"{self.target_loudness:g} LUFS, {self.peak_limit_target:g} dBTP, {self.output_format}"
+        return f"{self.name} ({label})" if self.name else label
+
+    @property
+    def suffix(self):
+        # added to the output file names, e.g. song_processed_-14LUFS.aac
+        return self.name or f"{self.target_loudness:g}LUFS"
+
+
+def check_output_format(output_format):
+    # the formats offered by the UI and the CLI; process_single_audio takes any the encoder knows
+    if str(output_format).upper() not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format: {output_format}")
+    return output_format
+
+
+def parse_deliverable(spec, peak_limit_target, output_format, limiter_lookahead=DEFAULT_LOOKAHEAD, limiter_release=DEFAULT_RELEASE):
+    """Deliverable from "TARGET[, PEAK[, FORMAT]]" (commas, colons or spaces); missing parts use the given defaults."""
+    parts = [part for part in re.split(r"[,:\s]+", spec.strip()) if part]
+    if not 1 <= len(parts) <= 3:
+        raise ValueError(f"Expected TARGET[, PEAK[, FORMAT]], got {spec!r}")
+    try:
+        target_loudness = float(parts[0])
+        if len(parts) > 1:
+            peak_limit_target = float(parts[1])
+    except ValueError:
+        raise ValueError(f"Target and peak must be numbers, got {spec!r}")
+    if len(parts) > 2:
+        output_format = parts[2]
+    return Deliverable(target_loudness, peak_limit_target, check_output_format(output_format), limiter_lookahead, limiter_release)
+
+
+def parse_deliverables(text, peak_limit_target, output_format, limiter_lookahead=DEFAULT_LOOKAHEAD, limiter_release=DEFAULT_RELEASE):
+    """One Deliverable per non-empty line of `text`; lines starting with # are skipped."""
+    return [parse_deliverable(line, peak_limit_target, output_format, limiter_lookahead, limiter_release)
+            for line in (text or "").splitlines() if line.strip() and not line.strip().startswith("#")]
+
+
+def preset_deliverable(preset_name, target_loudness, output_format):
+    """Deliverable from the peak and limiter settings of a preset.
+
+    Presets saved with a target loudness and output format use them, others
+    take the given ones. The compression settings of the preset are not used.
+    """
+    preset_data = read_preset(preset_name)
+    return Deliverable(preset_data.get("target_loudness", target_loudness), preset_data["peak_limit_target"],
+                       check_output_format(preset_data.get("output_format", output_format)),
+                       preset_data.get("limiter_lookahead", DEFAULT_LOOKAHEAD), preset_data.get("limiter_release", DEFAULT_RELEASE),
+                       name=preset_name)
@@ -0,0 +1,189 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Verbosity of the JSON-lines log: 0 logs nothing, 1 one record per file and
+# per batch, 2 also every stage. Set through the environment so worker
+# processes inherit it (see `configure`).
+QUIET, INFO, DEBUG = 0, 1, 2
+LOG_LEVEL_ENV = "LOUDV1_LOG_LEVEL"
+LOG_FILE_ENV = "LOUDV1_LOG_FILE"
+
+_local = threading.local()
+_log_lock = threading.Lock()
+
+
+def configure(level=None, path=None):
+    """Set the log verbosity and file (stderr when unset) for this process and the workers it starts."""
+    if level is not None:
+        os.environ[LOG_LEVEL_ENV] = str(int(level))
+    if path is not None:
+        os.environ[LOG_FILE_ENV] = path
+
+
+def log_level():
+    try:
+        return int(os.environ.get(LOG_LEVEL_ENV, QUIET))
+    except ValueError:
+        return QUIET
+
+
+def log_event(event, level=INFO, **fields):
+    """Write one JSON line for `event` if the verbosity allows it."""
+    if level > log_level():
+        return
+    record = json.dumps({"time": round(time.time(), 3), "pid": os.getpid(), "event": event, **fields}, default=str)
+    path = os.environ.get(LOG_FILE_ENV)
+    with _log_lock:
+        if path:
+            # Lines from several processes are appended with one write each.
+            with open(path, "a") as f:
+                f.write(record + "\n")
+        else:
+            sys.stderr.write(record + "\n")
+            sys.stderr.flush()
+
+
+def reset_peak_memory():
+    # Linux resets the peak RSS (VmHWM) of the process on "5"; elsewhere the
+    # peak covers the life of the process.
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_memory():
+    """Peak resident memory of this process in bytes, or None where it is not available."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+class FileMetrics:
+    """Timing, byte counters, peak memory and cache use of processing one file.
+
+    Filled by `stage`, `count` and `record_cache` while the file is the
+    current one (see `measure_file`) and sent back from worker processes as
+    the plain dict returned by `as_dict`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stages = {}
+        self.counters = {}
+        self.cache = {}
+        self.seconds = None
+        self.audio_seconds = None
+        self.peak_memory = None
+
+    @property
+    def realtime_factor(self):
+        return self.audio_seconds / self.seconds if self.audio_seconds and self.seconds else None
+
+    def as_dict(self):
+        return {"file": self.path, "seconds": self.seconds, "audio_seconds": self.audio_seconds,
+                "realtime_factor": self.realtime_factor, "stages": self.stages, "counters": self.counters,
+                "cache": self.cache, "peak_memory": self.peak_memory}
+
+
+def current_metrics():
+    return getattr(_local, "metrics", None)
+
+
+@contextmanager
+def measure_file(path):
+    """Collect a FileMetrics for the work on `path` done inside the block, then log it."""
+    metrics = FileMetrics(path)
+    previous = current_metrics()
+    _local.metrics = metrics
+    reset_peak_memory()
+    start = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics.seconds = time.perf_counter() - start
+        metrics.peak_memory = peak_memory()
+        _local.metrics = previous
+        log_event("file", **metrics.as_dict())
+
+
+@contextmanager
+def stage(name):
+    """Time a pipeline stage; the time is added to the current file's metrics."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.stages[name] = metrics.stages.get(name, 0.0) + elapsed
+        log_event("stage", DEBUG, stage=name, seconds=elapsed, file=metrics.path if metrics else None)
+
+
+def count(counter, amount):
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.counters[counter] = metrics.counters.get(counter, 0) + int(amount)
+
+
+def record_cache(kind, hit):
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.cache[kind] = "hit" if hit else "miss"
+
+
+def set_audio_seconds(seconds):
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.audio_seconds = seconds
+
+
+def summarize(metrics_list):
+    """Totals over the per-file metrics dicts of a batch: seconds per stage, counters and cache use."""
+    summary = {"files": 0, "seconds": 0.0, "audio_seconds": 0.0, "stages": {}, "counters": {}, "cache_hits": 0,
+               "cache_misses": 0, "peak_memory": None}
+    for metrics in metrics_list:
+        if not metrics:
+            continue
+        summary["files"] += 1
+        summary["seconds"] += metrics.get("seconds") or 0.0
+        summary["audio_seconds"] += metrics.get("audio_seconds") or 0.0
+        for name, seconds in metrics.get("stages", {}).items():
+            summary["stages"][name] = summary["stages"].get(name, 0.0) + seconds
+        for name, amount in metrics.get("counters", {}).items():
+            summary["counters"][name] = summary["counters"].get(name, 0) + amount
+        for state in metrics.get("cache", {}).values():
+            summary["cache_hits" if state == "hit" else "cache_misses"] += 1
+        if metrics.get("peak_memory"):
+            summary["peak_memory"] = max(summary["peak_memory"] or 0, metrics["peak_memory"])
+    return summary
+
+
+def bottleneck(summary):
+    """(stage, share of the stage time) of the slowest stage in a summary, or None."""
+    stages = summary["stages"]
+    total = sum(stages.values())
+    if not total:
+        return None
+    name = max(stages, key=stages.get)
+    return name, stages[name] / total
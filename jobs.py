@@ -0,0 +1,267 @@
+import copy
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from batch import MAX_WORKERS, output_paths_for, process_batch, process_batch_deliverables, process_pool
+from cache import link_file
+from instrumentation import log_event
+
+# Batches processed at the same time; later ones wait in the queue. Their
+# files share one pool of MAX_WORKERS processes.
+MAX_CONCURRENT_JOBS = int(os.environ.get("LOUDV1_MAX_JOBS", 2))
+# Finished jobs and their output directories are removed after this long.
+JOB_RETENTION_SECONDS = float(os.environ.get("LOUDV1_JOB_RETENTION_HOURS", 24)) * 3600
+# How often JobManager.watch checks a job that has not changed.
+WATCH_INTERVAL = 1.0
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class Job:
+    """One batch submitted to a JobManager and its progress.
+
+    `results` maps the slot of each finished output to its batch.BatchResult
+    and `output_paths` holds the files in the job's own output directory, by
+    slot. Slots are the input indexes, or with deliverables one per input and
+    deliverable, input by input.
+    `meta` is left to the caller (the web UI keeps its table rows there).
+    Read a job through JobManager.snapshot while it may still be running.
+    """
+
+    def __init__(self, job_id, input_paths, output_dir, params, meta=None):
+        self.id = job_id
+        self.input_paths = input_paths
+        self.output_dir = output_dir
+        self.params = params
+        self.meta = meta or {}
+        self.state = QUEUED
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.results = {}
+        self.output_paths = [None] * (len(input_paths) * len(params.get("deliverables") or [None]))
+        self.version = 0
+        self.cancel_requested = False
+
+    @property
+    def done(self):
+        return self.state in (COMPLETED, FAILED, CANCELLED)
+
+    def copy(self):
+        job = copy.copy(self)
+        job.results = dict(self.results)
+        job.output_paths = list(self.output_paths)
+        return job
+
+
+class JobManager:
+    """Server-side queue of processing jobs shared by every session of the web UI.
+
+    Each submitted batch gets a job ID and an output directory under
+    `jobs_dir`. At most `max_concurrent_jobs` run at once, on one shared pool
+    of `max_workers` processes (batch.run_tasks), so concurrent users take
+    turns on the CPU instead of each starting a full pool. Results come from
+    the shared cache and are hard-linked into the job's directory, so a job
+    can be deleted (or the cache evicted) without affecting any other job.
+    Jobs run in background threads and outlive the request that submitted
+    them; any session that knows a job ID can follow it with `watch`.
+    """
+
+    def __init__(self, jobs_dir, cache=None, max_workers=MAX_WORKERS, max_concurrent_jobs=MAX_CONCURRENT_JOBS,
+                 retention_seconds=JOB_RETENTION_SECONDS):
+        self.jobs_dir = jobs_dir
+        self.cache = cache
+        self.max_workers = max(1, int(max_workers or 1))
+        self.retention_seconds = retention_seconds
+        self.executor = process_pool(self.max_workers)
+        self._runner = ThreadPoolExecutor(max_workers=max_concurrent_jobs, thread_name_prefix="loudv1-job")
+        self._jobs = {}
+        self._condition = threading.Condition()
+        os.makedirs(jobs_dir, exist_ok=True)
+
+    def submit(self, input_paths, output_format, target_loudness, threshold, ratio, attack, release, peak_limit_target,
+               limiter_lookahead, limiter_release, max_workers=None, measure_original=False, meta=None, deliverables=None):
+        """Queue a batch (arguments as batch.process_batch) and return its Job.
+
+        With a list of deliverables.Deliverable, every input is rendered to
+        each of them instead (batch.process_batch_deliverables), and the
+        target, peak, format and limiter arguments are not used.
+        """
+        self.cleanup_expired()
+        job_id = uuid.uuid4().hex
+        output_dir = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(output_dir, exist_ok=True)
+        params = dict(output_format=output_format, target_loudness=target_loudness, threshold=threshold, ratio=ratio,
+                      attack=attack, release=release, peak_limit_target=peak_limit_target,
+                      limiter_lookahead=limiter_lookahead, limiter_release=limiter_release,
+                      max_workers=min(int(max_workers or self.max_workers), self.max_workers), measure_original=measure_original,
+                      deliverables=list(deliverables or []))
+        job = Job(job_id, list(input_paths), output_dir, params, meta)
+        with self._condition:
+            self._jobs[job_id] = job
+        print(f"JobManager: Job {job_id} queued with {len(job.input_paths)} files")
+        log_event("job", job=job_id, state=QUEUED, files=len(job.input_paths))
+        self._runner.submit(self._run, job)
+        return job
+
+    def _update(self, job, **changes):
+        with self._condition:
+            for key, value in changes.items():
+                setattr(job, key, value)
+            job.version += 1
+            self._condition.notify_all()
+
+    def _run(self, job):
+        if job.cancel_requested:
+            return
+        self._update(job, state=RUNNING)
+        log_event("job", job=job.id, state=RUNNING)
+        params = dict(job.params)
+        output_format = params.pop("output_format")
+        deliverables = params.pop("deliverables")
+        job_paths = output_paths_for(job.input_paths, job.output_dir, output_format, deliverables)
+        state, error = COMPLETED, None
+        if deliverables:
+            results = process_batch_deliverables(job.input_paths, deliverables, params["threshold"], params["ratio"], params["attack"],
+                                                 params["release"], params["max_workers"], cache=self.cache, output_paths=job_paths,
+                                                 measure_original=params["measure_original"], executor=self.executor,
+                                                 replace_executor=self.replace_executor)
+        else:
+            results = process_batch(job.input_paths, output_format, **params, cache=self.cache, output_paths=job_paths,
+                                    executor=self.executor, replace_executor=self.replace_executor)
+        try:
+            for result in results:
+                if job.cancel_requested:
+                    break
+                slot = result.index if result.deliverable is None else result.index * len(deliverables) + result.deliverable
+                output_path = result.output_path
+                if self.cache is not None and output_path:
+                    try:
+                        output_path = link_file(output_path, job_paths[slot])
+                    except OSError as e:
+                        # the cache entry was evicted before it could be linked
+                        result.status, output_path = f"Processing failed: {str(e)}", None
+                with self._condition:
+                    job.results[slot] = result
+                    job.output_paths[slot] = output_path
+                    job.version += 1
+                    self._condition.notify_all()
+        except Exception as e:
+            print(f"JobManager: Job {job.id} failed: {e}")
+            state, error = FAILED, str(e)
+        finally:
+            # files of this job that have not started are cancelled
+            results.close()
+        if job.cancel_requested:
+            state = CANCELLED
+        self._update(job, state=state, error=error, finished=time.time())
+        print(f"JobManager: Job {job.id} {state}")
+        log_event("job", job=job.id, state=state, error=error, seconds=job.finished - job.created)
+
+    def replace_executor(self, broken):
+        """The shared pool, replaced first if it is still the `broken` one (a worker process died).
+
+        Every batch that finds the pool broken calls this, only the first
+        one starts a new pool.
+        """
+        with self._condition:
+            if self.executor is broken:
+                print("JobManager: Process pool broken, starting a new one")
+                log_event("pool", state="replaced")
+                self.executor = process_pool(self.max_workers)
+                broken.shutdown(wait=False)
+            return self.executor
+
+    def get(self, job_id):
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    def snapshot(self, job_id):
+        """A copy of the job that is safe to read while it runs, or None."""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            return job.copy() if job else None
+
+    def queue_position(self, job_id):
+        """1-based position of a queued job among the queued jobs, or 0 once it has started."""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or job.state != QUEUED:
+                return 0
+            return 1 + sum(1 for other in self._jobs.values() if other.state == QUEUED and other.created < job.created)
+
+    def active_jobs(self):
+        with self._condition:
+            return sum(1 for job in self._jobs.values() if not job.done)
+
+    def watch(self, job_id, interval=WATCH_INTERVAL):
+        """Yield a snapshot of the job each time it changes (or moves up the queue) until it is done."""
+        last = None
+        while True:
+            with self._condition:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    return
+                self._condition.wait_for(lambda: (job.version, self.queue_position(job_id)) != last, timeout=interval)
+                current = (job.version, self.queue_position(job_id))
+                snapshot = job.copy() if current != last else None
+            if snapshot is not None:
+                last = current
+                yield snapshot
+                if snapshot.done:
+                    return
+
+    def cancel(self, job_id):
+        """Stop a job: queued jobs never start, a running one stops after the files already in progress."""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                return False
+            job.cancel_requested = True
+            if job.state == QUEUED:
+                job.state = CANCELLED
+                job.finished = time.time()
+            job.version += 1
+            self._condition.notify_all()
+        print(f"JobManager: Job {job_id} cancelled")
+        return True
+
+    def delete(self, job_id):
+        """Cancel a job and remove it with its output directory."""
+        self.cancel(job_id)
+        with self._condition:
+            job = self._jobs.pop(job_id, None)
+            self._condition.notify_all()
+        if job is not None:
+            shutil.rmtree(job.output_dir, ignore_errors=True)
+            print(f"JobManager: Job {job_id} deleted")
+        return job is not None
+
+    def cleanup_expired(self):
+        """Delete finished jobs older than the retention period, and output directories left by earlier runs of the server."""
+        cutoff = time.time() - self.retention_seconds
+        with self._condition:
+            expired = [job.id for job in self._jobs.values() if job.done and job.finished and job.finished < cutoff]
+            known = set(self._jobs)
+        for job_id in expired:
+            self.delete(job_id)
+        for name in os.listdir(self.jobs_dir):
+            path = os.path.join(self.jobs_dir, name)
+            if name not in known and os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        return len(expired)
+
+    def shutdown(self):
+        with self._condition:
+            job_ids = list(self._jobs)
+        for job_id in job_ids:
+            self.cancel(job_id)
+        self._runner.shutdown(wait=True)
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,181 @@
+import numpy as np
+import scipy.ndimage
+from meter import LoudnessMeter, true_peak_matrix
+
+# Default look-ahead and release in ms. The release is exponential in dB: the
+# gain reduction falls to 1/e of its value in `release` ms.
+DEFAULT_LOOKAHEAD = 5.0
+DEFAULT_RELEASE = 50.0
+# The gain curve changes within the span of the true-peak interpolation
+# filter, so the limited output can still overshoot between samples: about
+# 0.02 dB at a 1 ms look-ahead, 0.5 dB with none. Shorter look-aheads are
+# raised to MIN_LOOKAHEAD and true-peak limiting aims TRUE_PEAK_MARGIN dB
+# below the ceiling.
+MIN_LOOKAHEAD = 1.0
+TRUE_PEAK_MARGIN = 0.05
+# Frames processed per vectorized pass, bounds the temporary arrays.
+DEFAULT_CHUNK_SIZE = 1 << 18
+# limiter_makeup_gain stops once the limited output is this close to the
+# target (in LU), or after this many trial passes.
+MAKEUP_TOLERANCE = 0.05
+MAKEUP_PASSES = 3
+# Smallest slope (LU per dB of gain) a secant step assumes; under heavy
+# limiting the loudness barely follows the gain and the step would run away.
+MAKEUP_MIN_SLOPE = 0.1
+
+
+class Limiter:
+    """Vectorized look-ahead brickwall limiter with a true-peak ceiling.
+
+    Works on float32 arrays shaped (frames, channels). For every frame the gain
+    needed to keep its peak (the 4x-oversampled true peak with `true_peak`,
+    using the meter's interpolation filter) at or below `ceiling` dBFS is
+    computed; a forward minimum over the look-ahead window followed by a moving
+    average over the same window turns that into a gain curve that reaches
+    each reduction before the peak arrives without ever exceeding it. The
+    release is exponential in dB and evaluated in closed form with a running
+    maximum.
+
+    The output lags the input by `latency` frames. `process` returns as many
+    frames as the look-ahead allows and keeps the rest; `flush` returns the
+    remainder at the end of the signal.
+    """
+
+    def __init__(self, frame_rate, channels, ceiling=-1.0, lookahead=DEFAULT_LOOKAHEAD, release=DEFAULT_RELEASE, true_peak=True):
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.ceiling = ceiling
+        self.lookahead = lookahead
+        self.release = release
+        self.true_peak = true_peak
+        self.ceiling_gain = 10 ** ((ceiling - (TRUE_PEAK_MARGIN if true_peak else 0.0)) / 20.0)
+        self.lookahead_frames = max(1, int(round(frame_rate * max(lookahead, MIN_LOOKAHEAD) / 1000.0)))
+        self.release_frames = max(frame_rate * release / 1000.0, 1.0)
+        self._true_peak_matrix = true_peak_matrix() if true_peak else None
+        taps = len(self._true_peak_matrix) if true_peak else 1
+        # Interpolated samples are centred between the frames `delay` and
+        # `delay` + 1 frames before the last input frame of their window.
+        self._true_peak_delay = taps // 2 - 1
+        self.latency = self.lookahead_frames + (self._true_peak_delay + 1 if true_peak else 0)
+        # Frames before the first unprocessed one that the peak detection,
+        # minimum and moving average over the look-ahead window look back on.
+        self._history_frames = self.lookahead_frames + taps + self._true_peak_delay + 1
+        self.reset()
+
+    def reset(self):
+        self._buffer = np.zeros((self._history_frames, self.channels), dtype=np.float32)
+        self._attenuation = 0.0
+        self.max_attenuation = 0.0
+
+    def frame_peaks(self, samples):
+        """Per-frame peak of `samples`, with the true peak of the interpolated samples next to each frame."""
+        peaks = np.max(np.abs(samples), axis=1)
+        if not self.true_peak:
+            return peaks
+        taps = len(self._true_peak_matrix)
+        windows = np.lib.stride_tricks.sliding_window_view(samples, taps, axis=0)
+        interpolated = np.max(np.abs(windows @ self._true_peak_matrix), axis=(1, 2))
+        # Window i ends at frame i + taps - 1 and its samples lie between
+        # frames i + taps - 2 - delay and i + taps - 1 - delay.
+        for first in (taps - 2 - self._true_peak_delay, taps - 1 - self._true_peak_delay):
+            np.maximum(peaks[first:first + len(interpolated)], interpolated, out=peaks[first:first + len(interpolated)])
+        return peaks
+
+    def gain_curve(self, buffer, start, count):
+        """Linear gain for `count` frames of `buffer` from `start` on, updating the release state."""
+        with np.errstate(divide="ignore"):
+            required = np.minimum(1.0, self.ceiling_gain / self.frame_peaks(buffer))
+        window = self.lookahead_frames + 1
+        # minimum of required[k:k + window], then the mean of that over the
+        # `window` frames ending at each output frame
+        forward_min = scipy.ndimage.minimum_filter1d(required, window, origin=-(window // 2), mode="nearest")
+        cumulative = np.concatenate(([0.0], np.cumsum(forward_min[start - window + 1:start + count], dtype=np.float64)))
+        smoothed = (cumulative[window:] - cumulative[:-window]) / window
+
+        # Exponential release in dB: attenuation[n] = max(required[n],
+        # attenuation[n - 1] * decay), i.e. the running maximum of
+        # required[k] * decay ** (n - k), evaluated in the log domain.
+        with np.errstate(divide="ignore"):
+            log_required = np.log(np.maximum(-20.0 * np.log10(smoothed), 0.0))
+            log_previous = np.log(self._attenuation) if self._attenuation > 0 else -np.inf
+        log_decay = -1.0 / self.release_frames
+        steps = np.arange(count) * log_decay
+        log_attenuation = steps + np.maximum(np.maximum.accumulate(log_required - steps), log_previous + log_decay)
+        attenuation = np.exp(log_attenuation)
+        if count:
+            self._attenuation = float(attenuation[-1])
+            self.max_attenuation = max(self.max_attenuation, float(attenuation.max()))
+        return (10 ** (-attenuation / 20.0)).astype(np.float32)
+
+    def process(self, samples, out=None):
+        """Limit the next block of `samples`; returns the frames that are ready (up to `latency` fewer).
+
+        With `out`, the frames are written to the start of `out` instead of a new array.
+        """
+        buffer = np.concatenate((self._buffer, samples))
+        start = self._history_frames
+        count = max(0, len(buffer) - start - self.latency)
+        if out is None:
+            out = np.empty((count, self.channels), dtype=np.float32)
+        for offset in range(0, count, DEFAULT_CHUNK_SIZE):
+            end = min(count, offset + DEFAULT_CHUNK_SIZE)
+            # the frames being limited and the history/look-ahead around them
+            view = buffer[start + offset - self._history_frames:start + end + self.latency]
+            gain = self.gain_curve(view, self._history_frames, end - offset)
+            np.multiply(buffer[start + offset:start + end], gain[:, None], out=out[offset:end])
+        self._buffer = buffer[count:]
+        return out[:count]
+
+    def flush(self):
+        """The last `latency` frames of the signal."""
+        remaining = len(self._buffer) - self._history_frames
+        return self.process(np.zeros((self.latency, self.channels), dtype=np.float32))[:remaining]
+
+
+def limited_loudness(blocks, frame_rate, channels, gain_db, ceiling, lookahead=DEFAULT_LOOKAHEAD, release=DEFAULT_RELEASE):
+    """Integrated loudness of `blocks` after `gain_db` and the limiter, without keeping the output."""
+    gain = np.float32(10 ** (gain_db / 20))
+    limiter = Limiter(frame_rate, channels, ceiling, lookahead, release)
+    meter = LoudnessMeter(frame_rate, channels)
+    for block in blocks:
+        meter.process(limiter.process(block * gain))
+    meter.process(limiter.flush())
+    return meter.integrated_loudness()
+
+
+def limiter_makeup_gain(blocks, frame_rate, channels, gain_db, target_loudness, ceiling, lookahead=DEFAULT_LOOKAHEAD,
+                        release=DEFAULT_RELEASE, tolerance=MAKEUP_TOLERANCE, passes=MAKEUP_PASSES):
+    """Gain in dB to add to `gain_db` so the limited output still reaches target_loudness.
+
+    `blocks` is called for a fresh iterator over the signal for every trial
+    pass. The first pass measures the loudness the limiter takes away at
+    `gain_db` and adds it back; as the extra gain makes the limiter work
+    harder, further passes refine the gain with secant steps until the
+    limited loudness is within `tolerance` LU of the target, for at most
+    `passes` passes. If the last pass still misses, one more secant step
+    (not measured) is taken.
+    """
+    trials = []
+    trial_gain = gain_db
+    for _ in range(passes):
+        loudness = limited_loudness(blocks(), frame_rate, channels, trial_gain, ceiling, lookahead, release)
+        if not np.isfinite(loudness):
+            return 0.0
+        trials.append((trial_gain, loudness))
+        if abs(target_loudness - loudness) <= tolerance:
+            break
+        trial_gain = makeup_step(trials, target_loudness)
+    return max(0.0, trial_gain - gain_db)
+
+
+def makeup_step(trials, target_loudness):
+    """Next gain to try from the (gain_db, limited loudness) trials so far."""
+    gain, loudness = trials[-1]
+    slope = 1.0
+    if len(trials) > 1:
+        previous_gain, previous_loudness = trials[-2]
+        if gain != previous_gain:
+            slope = min(1.0, max(MAKEUP_MIN_SLOPE, (loudness - previous_loudness) / (gain - previous_gain)))
+    return gain + (target_loudness - loudness) / slope
+
+
@@ -1,154 +1,207 @@
 import gradio as gr
-from pydub import AudioSegment
-from pydub.effects import compress_dynamic_range
-import pyloudnorm as pyln
-import io
 import os
-import numpy as np
-import tempfile
 import shutil
 import platform
 import subprocess
-import json
+from batch import MAX_WORKERS, scan_loudness
+from limiter import DEFAULT_LOOKAHEAD, DEFAULT_RELEASE, MIN_LOOKAHEAD
+from cache import ResultCache
+from deliverables import parse_deliverables, preset_deliverable
+from instrumentation import bottleneck, summarize
+from jobs import QUEUED, JobManager
+from streaming import probe_audio
+from presets import PRESETS_DIR, get_available_presets, preset_path, read_preset, write_preset
 
 CACHE_DIR = "gradio_cache"
-PRESETS_DIR = "presets"
 os.makedirs(CACHE_DIR, exist_ok=True)
 os.makedirs(PRESETS_DIR, exist_ok=True)
+RESULT_CACHE = ResultCache(CACHE_DIR)
+# Every Process click becomes a job with its own output directory here; jobs
+# from all sessions share one pool of worker processes.
+JOBS_DIR = os.path.join(CACHE_DIR, "jobs")
+JOB_MANAGER = JobManager(JOBS_DIR, RESULT_CACHE)
+# Gradio removes uploaded files older than a day, checking every hour.
+GRADIO_CACHE_CLEANUP = (3600, 86400)
+# Loudness stats of the processed files shown in the table (see meter.LoudnessMeter.stats)
+STATS_COLUMNS = {
+    "lra": "LRA (LU)",
+    "true_peak": "True Peak (dBTP)",
+    "short_term_max": "Max Short-term (LUFS)",
+    "momentary_max": "Max Momentary (LUFS)",
+}
+# Per-file instrumentation shown in the table (see instrumentation.FileMetrics)
+METRICS_COLUMNS = {
+    "seconds": "Processing Time (s)",
+    "realtime_factor": "Realtime Factor",
+}
+RESULT_COLUMNS = len(STATS_COLUMNS) + len(METRICS_COLUMNS)
 
-def calculate_lufs(audio_file_path):
-    try:
-        audio = AudioSegment.from_file(audio_file_path)
-        samplerate = audio.frame_rate
-        data = np.array(audio.get_array_of_samples())
-        if audio.sample_width == 1:
-            data = (data / 2**7).astype(np.float32)
-        elif audio.sample_width == 2:
-            data = (data / 2**15).astype(np.float32)
-        elif audio.sample_width == 3:
-            data = (data / 2**23).astype(np.float32)
-        elif audio.sample_width == 4:
-            data = (data / 2**31).astype(np.float32)
-        meter = pyln.Meter(samplerate)
-        loudness = meter.integrated_loudness(data)
-        return loudness
-    except Exception as e:
-        return f"Unable to calculate LUFS: {str(e)}"
-
-def process_single_audio(file_name, file_list, output_format, target_loudness, threshold, ratio, attack, release, peak_limit_target):
-    normalized_file_name = file_name.lower().strip()
-    print(f"process_single_audio: Processing file (normalized): {normalized_file_name}, Target Loudness: {target_loudness} LUFS")
-    print(f"process_single_audio: Dynamic compression parameters - threshold={threshold}, ratio={ratio}, attack={attack}, release={release}")
-    print(f"process_single_audio: Peak limit target - {peak_limit_target} dBFS")
-    audio_file_obj = next((f for f in file_list if os.path.basename(f.name).lower().strip() == normalized_file_name), None)
-    if not audio_file_obj:
-        print(f"process_single_audio: File not found: {file_name}")
-        return "File not found", None
-
-    try:
-        audio = AudioSegment.from_file(audio_file_obj.name)
-        compressed_audio = compress_dynamic_range(audio, threshold=threshold, ratio=ratio, attack=attack, release=release)
-        gain_reduction = max(0, compressed_audio.max_dBFS - peak_limit_target)
-        limited_audio = compressed_audio - gain_reduction
-        samplerate = limited_audio.frame_rate
-        data = np.array(limited_audio.get_array_of_samples())
-        if limited_audio.sample_width == 1:
-            data = (data / 2**7).astype(np.float32)
-        elif limited_audio.sample_width == 2:
-            data = (data / 2**15).astype(np.float32)
-        elif limited_audio.sample_width == 3:
-            data = (data / 2**23).astype(np.float32)
-        elif limited_audio.sample_width == 4:
-            data = (data / 2**31).astype(np.float32)
-        meter = pyln.Meter(samplerate)
-        loudness = meter.integrated_loudness(data)
-        delta_loudness = target_loudness - loudness
-        normalized_audio = limited_audio.apply_gain(delta_loudness)
-        output_buffer = io.BytesIO()
-        normalized_audio.export(output_buffer, format=output_format.lower())
-        output_buffer.seek(0)
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
 
-        original_name, ext = os.path.splitext(file_name)
-        cache_file_path = os.path.join(CACHE_DIR, f"{original_name}_processed.{output_format.lower()}")
-        with open(cache_file_path, "wb") as f:
-            f.write(output_buffer.read())
+def metrics_row(metrics):
+    values = [metrics.get(key) for key in METRICS_COLUMNS]
+    return [round(value, 2) if value is not None else None for value in values]
 
-        print(f"process_single_audio: File processing completed, saved to cache: {cache_file_path}")
-        return "Completed", cache_file_path
+def format_metrics_summary(metrics_list):
+    summary = summarize(metrics_list)
+    if not summary["files"]:
+        return ""
+    lines = [f"**{summary['files']} files**, {format_duration(summary['audio_seconds'])} of audio in "
+             f"{summary['seconds']:.1f} s of worker time"]
+    if summary["seconds"] and summary["audio_seconds"]:
+        lines[0] += f" ({summary['audio_seconds'] / summary['seconds']:.0f}x realtime)"
+    slowest = bottleneck(summary)
+    if slowest:
+        lines.append(f"Slowest stage: **{slowest[0]}** ({slowest[1]:.0%} of stage time)")
+        lines.append("Stage time: " + ", ".join(f"{name} {seconds:.2f} s" for name, seconds in
+                                                sorted(summary["stages"].items(), key=lambda item: -item[1])))
+    if summary["counters"]:
+        lines.append("Data: " + ", ".join(f"{name.replace('_', ' ')} {amount / 2**20:.1f} MB" for name, amount in summary["counters"].items()))
+    if summary["peak_memory"]:
+        lines.append(f"Peak memory per worker: {summary['peak_memory'] / 2**20:.0f} MB")
+    lines.append(f"Cache: {summary['cache_hits']} hits, {summary['cache_misses']} misses")
+    return "\n\n".join(lines)
 
-    except Exception as e:
-        print(f"process_single_audio: Processing failed: {str(e)}")
-        return f"Processing failed: {str(e)}", None
-
-def on_file_upload(audio_files, file_info_state):
+def on_file_upload(audio_files, file_info_state, quick_estimate=False, max_workers=MAX_WORKERS):
+    # The table is filled from the file headers first; loudness is measured on
+    # a process pool afterwards and each value is filled in as it arrives.
+    # The upload path of each row is kept alongside it, as uploads from
+    # different folders can share a name.
+    input_paths = [audio_file.name for audio_file in audio_files]
     file_info = []
     for audio_file in audio_files:
         file_name = os.path.basename(audio_file.name)
         print(f"on_file_upload: Filename added to file_info: {file_name}")
-        lufs = calculate_lufs(audio_file.name)
-        file_info.append([file_name, "Waiting to process", lufs, None])
-    return gr.update(value=file_info), file_info
+        try:
+            info = probe_audio(audio_file.name)
+            metadata = [format_duration(info.duration_seconds), info.frame_rate, info.channels]
+        except Exception as e:
+            print(f"on_file_upload: Unable to read metadata of {file_name}: {e}")
+            metadata = [None, None, None]
+        file_info.append([file_name, "Waiting to process", "Measuring...", None, *metadata, *[None] * RESULT_COLUMNS, None])
+    yield gr.update(value=file_info), file_info, input_paths
+
+    for result in scan_loudness(input_paths, max_workers=max_workers, cache=RESULT_CACHE, quick_estimate=quick_estimate,
+                                executor=JOB_MANAGER.executor, replace_executor=JOB_MANAGER.replace_executor):
+        lufs = result.lufs
+        if result.error_bound is not None and not isinstance(lufs, str):
+            lufs = f"{lufs:.2f} ± {result.error_bound:.2f} (estimate)"
+        file_info[result.index][2] = lufs
+        yield gr.update(value=file_info), file_info, input_paths
 
-def process_all(file_info_list, file_list, output_format, target_loudness_input, threshold, ratio, attack, release, peak_limit_target):
-    print(f"process_all: Start processing all files, target loudness: -{target_loudness_input} LUFS")
+def process_all(file_info_list, upload_paths, output_format, target_loudness_input, threshold, ratio, attack, release, peak_limit_target,
+                limiter_lookahead=DEFAULT_LOOKAHEAD, limiter_release=DEFAULT_RELEASE, max_workers=MAX_WORKERS,
+                deliverables_input="", deliverable_presets=None):
+    # The batch runs as a background job and this only follows it, so the job
+    # carries on when the page is closed and follow_job picks it up again.
+    print(f"process_all: Start processing {len(file_info_list)} files, target loudness: -{target_loudness_input} LUFS")
     print(f"process_all: Dynamic compression parameters - threshold={threshold}, ratio={ratio}, attack={attack}, release={release}")
-    print(f"process_all: Peak limit target - {peak_limit_target} dBFS")
-    print(f"process_all: Initial file_info_list={file_info_list}")
-    print(f"process_all: file_list={[f.name for f in file_list]}")
+    print(f"process_all: Peak limit target - {peak_limit_target} dBTP, look-ahead={limiter_lookahead}, release={limiter_release}")
+    # With deliverables, each file gets one row per deliverable and the
+    # target, peak and format settings above only fill in what they leave out.
+    try:
+        deliverables = parse_deliverables(deliverables_input, peak_limit_target, output_format, limiter_lookahead, limiter_release)
+        deliverables += [preset_deliverable(name, -target_loudness_input, output_format) for name in deliverable_presets or []]
+    except Exception as e:
+        print(f"process_all: Invalid deliverables: {e}")
+        yield gr.update(), gr.update(), gr.update(), gr.update(), f"Invalid deliverables: {e}"
+        return
+    if deliverables:
+        print(f"process_all: Deliverables - {', '.join(deliverable.label for deliverable in deliverables)}")
+
     updated_file_info = []
-    download_files = []
-    for item in file_info_list:
-        filename = item[0]
-        print(f"process_all: Start processing file: {filename}")
-        status, output_file_path = process_single_audio(filename, file_list, output_format, -target_loudness_input, threshold, ratio, attack, release, peak_limit_target)
-        print(f"process_all: File {filename} processing result - Status: {status}, Output path: {output_file_path}")
-        processed_lufs = None
-        if output_file_path:
-            processed_lufs = calculate_lufs(output_file_path)
-            download_files.append(output_file_path)
-        updated_file_info.append([filename, status, item[2], processed_lufs])
-        print(f"process_all: Updated file_info - {updated_file_info[-1]}")
+    input_paths = []
+    row_indices = []
+    for row, item in enumerate(file_info_list):
+        input_path = upload_paths[row] if row < len(upload_paths) else None
+        if not input_path or not os.path.exists(input_path):
+            print(f"process_all: File not found: {item[0]}")
+            updated_file_info.append([item[0], "File not found", item[2], None, *item[4:7], *[None] * RESULT_COLUMNS, None])
+            continue
+        input_paths.append(input_path)
+        for label in [deliverable.label for deliverable in deliverables] or [None]:
+            row_indices.append(len(updated_file_info))
+            updated_file_info.append([item[0], "Queued", item[2], None, *item[4:7], *[None] * RESULT_COLUMNS, label])
+    # Rows still waiting for (or showing an estimate of) their original loudness
+    # get it measured exactly while they are processed.
+    measure_original = any(isinstance(item[2], str) or item[2] is None for item in file_info_list)
+    job = JOB_MANAGER.submit(input_paths, output_format, -target_loudness_input, threshold, ratio, attack, release, peak_limit_target,
+                             limiter_lookahead, limiter_release, max_workers=max_workers, measure_original=measure_original,
+                             meta={"rows": updated_file_info, "row_indices": row_indices}, deliverables=deliverables)
+    yield from follow_job(job.id)
+
+def job_status(job):
+    if job.state == QUEUED:
+        status = f"queued, position {JOB_MANAGER.queue_position(job.id)}"
+    else:
+        status = f"{job.state}, {len(job.results)} of {len(job.output_paths)} files done"
+    if job.error:
+        status += f" ({job.error})"
+    return f"Job `{job.id}`: {status}"
 
-    print(f"process_all: Processing completed, updated file_info_list={updated_file_info}")
-    return gr.update(value=updated_file_info), download_files
+def job_view(job):
+    updated_file_info = [list(row) for row in job.meta["rows"]]
+    for slot, result in job.results.items():
+        row = updated_file_info[job.meta["row_indices"][slot]]
+        row[1] = result.status
+        if result.original_lufs is not None:
+            row[2] = result.original_lufs
+        row[3] = result.processed_lufs
+        row[7:7 + RESULT_COLUMNS] = [*[result.processed_stats.get(key) for key in STATS_COLUMNS], *metrics_row(result.metrics)]
+    download_files = [path for path in job.output_paths if path]
+    metrics_summary = format_metrics_summary([result.metrics for result in job.results.values()])
+    return gr.update(value=updated_file_info), download_files, metrics_summary, job.id, job_status(job)
 
-def clear_list(file_info_state):
-    print("Executing clear cache...")
-    clear_cache()
-    print("Cache cleared, preparing to clear page elements...")
-    return gr.update(value=[]), gr.update(value=[]), gr.update(value=None), gr.update(value=None)
+def follow_job(job_id):
+    # Also runs on page load with the job ID kept in the browser, to reconnect
+    # to a job that was started before a reload.
+    if not job_id or JOB_MANAGER.get(job_id) is None:
+        yield gr.update(), gr.update(), gr.update(), None, ""
+        return
+    job = None
+    for job in JOB_MANAGER.watch(job_id):
+        yield job_view(job)
+    if job is not None and job.done:
+        print(f"follow_job: Job {job_id} {job.state}, {len([path for path in job.output_paths if path])} of "
+              f"{len(job.output_paths)} files processed")
+
+def cancel_job(job_id):
+    if job_id and JOB_MANAGER.cancel(job_id):
+        return f"Job `{job_id}`: cancelling"
+    return gr.update()
+
+def clear_list(file_info_state, job_id=None):
+    # Only this session's job and its output directory are removed. Uploads
+    # are left to Gradio's own cleanup (GRADIO_CACHE_CLEANUP) since identical
+    # uploads from other sessions share one temporary file. Processed results
+    # stay in the size-limited result cache, so uploading the same files
+    # again does not reprocess them.
+    if job_id:
+        JOB_MANAGER.delete(job_id)
+    print("clear_list: Job removed, clearing page elements...")
+    return gr.update(value=[]), gr.update(value=[]), [], gr.update(value=None), gr.update(value=None), "", None, ""
 
 def clear_cache():
     print("Clearing cache started...")
+    if JOB_MANAGER.active_jobs():
+        print("clear_cache: Jobs are still running, cache not cleared.")
+        return "Jobs are still running, cache not cleared."
     try:
-        # 清理 Gradio 临时缓存目录，但不删除 gradio 目录本身
-        temp_dir = tempfile.gettempdir()
-        gradio_temp_cache_dir = os.path.join(temp_dir, "gradio")
-        print(f"Clearing contents of Gradio temporary cache directory: {gradio_temp_cache_dir}")
-        try:
-            if os.path.exists(gradio_temp_cache_dir):
-                for item in os.listdir(gradio_temp_cache_dir):
-                    item_path = os.path.join(gradio_temp_cache_dir, item)
-                    try:
-                        if os.path.isfile(item_path) or os.path.islink(item_path):
-                            os.unlink(item_path)
-                        elif os.path.isdir(item_path):
-                            shutil.rmtree(item_path)
-                    except Exception as e:
-                        print(f"Unable to delete {item_path}. Reason: {e}")
-                print(f"Contents of Gradio temporary cache directory cleared: {gradio_temp_cache_dir}")
-            else:
-                print(f"Gradio temporary cache directory not found: {gradio_temp_cache_dir}")
-        except Exception as e:
-            print(f"Error occurred while clearing Gradio temporary cache directory: {e}")
-
         # 清理项目文件夹下的缓存，不清空目录本身
+        # Job outputs are hard links, so finished jobs keep their files.
+        print(f"Clearing result cache index: {RESULT_CACHE.index_path}")
+        RESULT_CACHE.clear()
         project_cache_dir = CACHE_DIR
         print(f"Clearing contents of project cache directory: {project_cache_dir}")
         try:
             if os.path.exists(project_cache_dir):
                 for item in os.listdir(project_cache_dir):
                     item_path = os.path.join(project_cache_dir, item)
+                    if item_path in (RESULT_CACHE.index_path, JOBS_DIR):
+                        continue
                     try:
                         if os.path.isfile(item_path) or os.path.islink(item_path):
                             os.unlink(item_path)
@@ -168,45 +221,9 @@ def clear_cache():
         print(f"A serious error occurred while clearing the cache: {overall_e}")
         return f"Failed to clear cache: {overall_e}"
 
-def batch_save_processed_files(file_info_list, uploaded_files_state):
-    if not uploaded_files_state:
-        print("batch_save_processed_files: No files uploaded, unable to determine save path.")
-        return "No files uploaded, unable to determine save path."
-
-    first_uploaded_file = uploaded_files_state[0].name
-    upload_dir = os.path.dirname(first_uploaded_file)
-    output_dir = os.path.join(upload_dir, "Normalized Loudness")
-    os.makedirs(output_dir, exist_ok=True)
-
-    saved_files = []
-    print(f"batch_save_processed_files: Preparing to save file information:")
-    for item in file_info_list:
-        print(f"  Filename: {item[0]}, Status: {item[1]}, Output path: {item[3]}")
-        if item[1] == "Completed" and item[3] is not None:
-            source_path = item[3]
-            filename = item[0]
-            output_filename = f"{os.path.splitext(filename)[0]}_processed{os.path.splitext(source_path)[1]}"
-            destination_path = os.path.join(output_dir, output_filename)
-            try:
-                shutil.copy2(source_path, destination_path)
-                saved_files.append(output_filename)
-                print(f"batch_save_processed_files: File {filename} saved successfully to {destination_path}")
-            except Exception as e:
-                print(f"batch_save_processed_files: Failed to save file {filename}: {e}")
-        else:
-            print(f"batch_save_processed_files: File {item[0]} not processed or no output path, skipping save.")
-
-    if saved_files:
-        message = f"Processed files saved to: {output_dir}"
-        print(f"batch_save_processed_files: {message}")
-        return message
-    else:
-        message = "No processed files available to save."
-        print(f"batch_save_processed_files: {message}")
-        return message
-
-def open_post_processing_folder():
-    folder_path = CACHE_DIR
+def open_post_processing_folder(job_id=None):
+    job = JOB_MANAGER.get(job_id) if job_id else None
+    folder_path = job.output_dir if job else CACHE_DIR
     if platform.system() == "Windows":
         os.startfile(folder_path)
     elif platform.system() == "Darwin":
@@ -216,42 +233,48 @@ def open_post_processing_folder():
     else:
         print(f"Unsupported operating system: {platform.system()}")
 
-def save_preset(preset_name, threshold, ratio, attack, release, peak_limit_target):
+def save_preset(preset_name, threshold, ratio, attack, release, peak_limit_target, limiter_lookahead, limiter_release,
+                target_loudness_input=None, output_format=None):
     preset_data = {
         "threshold": threshold,
         "ratio": ratio,
         "attack": attack,
         "release": release,
-        "peak_limit_target": peak_limit_target
+        "peak_limit_target": peak_limit_target,
+        "limiter_lookahead": limiter_lookahead,
+        "limiter_release": limiter_release
     }
-    preset_file_path = os.path.join(PRESETS_DIR, f"{preset_name}.json")
-    with open(preset_file_path, "w") as f:
-        json.dump(preset_data, f, indent=4)
+    # used when the preset is picked as a deliverable
+    if target_loudness_input is not None:
+        preset_data["target_loudness"] = -target_loudness_input
+    if output_format:
+        preset_data["output_format"] = output_format
+    write_preset(preset_name, preset_data)
     print(f"Preset saved: {preset_name}")
     return gr.Dropdown(choices=get_available_presets(), value=preset_name)
 
 def load_preset(preset_name):
-    preset_file_path = os.path.join(PRESETS_DIR, f"{preset_name}.json")
-    with open(preset_file_path, "r") as f:
-        preset_data = json.load(f)
+    preset_data = read_preset(preset_name)
     return (
         preset_data["threshold"],
         preset_data["ratio"],
         preset_data["attack"],
         preset_data["release"],
         preset_data["peak_limit_target"],
+        # presets saved before the look-ahead limiter do not have its settings
+        preset_data.get("limiter_lookahead", DEFAULT_LOOKAHEAD),
+        preset_data.get("limiter_release", DEFAULT_RELEASE),
+        -preset_data["target_loudness"] if "target_loudness" in preset_data else gr.update(),
+        preset_data.get("output_format", gr.update()),
     )
 
-def get_available_presets():
-    return [f.replace(".json", "") for f in os.listdir(PRESETS_DIR) if f.endswith(".json")]
-
 def refresh_presets():
     return gr.Dropdown(choices=get_available_presets())
 
 def delete_preset(available_presets):
     selected_preset = available_presets
     if selected_preset:
-        preset_file_path = os.path.join(PRESETS_DIR, f"{selected_preset}.json")
+        preset_file_path = preset_path(selected_preset)
         try:
             os.remove(preset_file_path)
             print(f"Preset deleted: {selected_preset}")
@@ -266,111 +289,165 @@ def delete_preset(available_presets):
         print("No preset selected for deletion.")
         return gr.Dropdown(choices=get_available_presets())
 
-with gr.Blocks(theme='JohnSmith9982/small_and_pretty') as iface:
-    uploaded_files_state = gr.State([])
-    output_format_state = gr.State("WAV")
-    file_info_state = gr.State([])
-    file_output = gr.Dataframe(headers=["Filename", "Processing Status", "Original LUFS", "Processed LUFS"])
-    download_output = gr.Files(label="Download Processed Files")
-    with gr.Row():
-        with gr.Column():
-            audio_input = gr.File(file_types=["audio"], label="Upload audio files", file_count="multiple")
-        with gr.Column():
-            output_format_label_html = """
-                <span title='**Output Format:** Select the file type to save the processed audio.\n\n* **WAV:** A lossless format that retains all audio details, offering the best quality but resulting in larger files, suitable for scenarios requiring the highest fidelity.\n* **AAC:** A lossy format that reduces file size through compression, providing good audio quality, suitable for network transmission and mobile devices.'>
-                    Output Format
-                </span>
-            """
-            gr.HTML(output_format_label_html)
-            output_format = gr.Radio(["WAV", "AAC"], value="WAV", label="")
-            attack_label_html = """
-                <span title='**Attack (ms):** The speed at which the dynamic range compressor starts reducing the volume after the audio signal's loudness exceeds the set Threshold. The unit is milliseconds (one-thousandth of a second).\n\n* **Function:** Affects the processing of sudden sounds (transients) in the audio. A shorter attack time can control sudden loud sounds, like drum hits, more quickly but might make the sound seem "muffled." A longer attack time preserves the impact of these sounds.\n* **Beginner Tip:** If your audio contains many sudden, sharp sounds, try a shorter attack time (e.g., 5ms). If you want to preserve the natural impact of sounds, try a longer attack time (e.g., 20ms).'>
-                    Attack (ms)
-                </span>
-            """
-            gr.HTML(attack_label_html)
-            attack_input = gr.Number(value=5.0, label="")
-            release_label_html = """
-                <span title='**Release (ms):** The speed at which the dynamic range compressor stops reducing the volume and returns to the original volume after the audio signal's loudness falls below the Threshold. The unit is milliseconds.\n\n* **Function:** Affects the smoothness of the compression process and the "breathing" of the sound. A shorter release time will cause the volume to recover quickly, which may lead to unnatural pumping or "breathing" effects. A longer release time makes volume changes smoother.\n* **Beginner Tip:** If your audio has a fast tempo, try a shorter release time (e.g., 50ms). If the tempo is slower, or you want more natural-sounding changes, try a longer release time (e.g., 150ms).'>
-                    Release (ms)
-                </span>
-            """
-            gr.HTML(release_label_html)
-            release_input = gr.Number(value=50.0, label="")
-        with gr.Column():
-            target_loudness_label_html = """
-                <span title='**Target Loudness (LUFS):** The overall loudness level you want the processed audio to achieve. LUFS is a unit for measuring audio loudness; the smaller the value, the quieter the sound.\n\n* **Function:** Unifies the volume of different audio files, preventing sudden changes in loudness during playback.\n* **Beginner Tip:** For online videos or music, common target loudness levels are between -16 LUFS and -14 LUFS. For podcasts or audiobooks, you can set it to -19 LUFS to -16 LUFS.'>
-                    Set Loudness Value -
-                </span>
-            """
-            gr.HTML(target_loudness_label_html)
-            target_loudness_input = gr.Number(value=16, precision=0, label="")
-            threshold_label_html = """
-                <span title='**Threshold (dBFS):** Sets a loudness "gate." When the audio signal's loudness exceeds this value, the dynamic range compressor starts working to reduce the volume. The unit is dBFS.\n\n* **Function:** Controls when the dynamic range compressor starts. Only sounds exceeding the threshold will be compressed.\n* **Beginner Tip:** You can set the threshold slightly below the loudest parts of your audio. For example, if the loudest part of the audio is -10 dBFS, you could try setting the threshold to -15 dBFS. Lowering the threshold will cause more sounds to be compressed.'>
-                    Threshold (dBFS)
-                </span>
-            """
-            gr.HTML(threshold_label_html)
-            threshold_input = gr.Number(value=-20.0, label="")
-            ratio_label_html = """
-                <span title='**Ratio:** Indicates the amount of compression applied when the audio signal's loudness exceeds the Threshold. For example, a ratio of 2:1 means that if the sound exceeds the threshold by 2 decibels, it will only increase by 1 decibel.\n\n* **Function:** Controls the degree of dynamic range reduction. A higher ratio will make the dynamic range smaller and the sound more "compact."\n* **Beginner Tip:** If you only want to slightly control volume fluctuations, use a lower ratio (e.g., 2:1 or 3:1). If you need to reduce the dynamic range more significantly, use a higher ratio (e.g., 4:1 or higher).'>
-                    Ratio
-                </span>
-            """
-            gr.HTML(ratio_label_html)
-            ratio_input = gr.Number(value=2.0, label="")
-        with gr.Column():
-            peak_limit_target_label_html = """
-                <span title='**Peak Limit Target (dBFS):** Sets the maximum loudness level allowed for the processed audio. The unit is dBFS.\n\n* **Function:** Prevents audio signal overload (causing clipping or distortion), ensuring sound quality.\n* **Beginner Tip:** Usually set to a value slightly below 0 dBFS, such as -1 dBFS or -2 dBFS. 0 dBFS is the maximum volume for digital audio; exceeding this value can lead to clipping distortion.'>
-                    Peak Limit Target (dBFS)
-                </span>
-            """
-            gr.HTML(peak_limit_target_label_html)
-            peak_limit_target_input = gr.Number(value=-3.0, label="")
-            preset_name_input = gr.Textbox(label="Preset Name")
-            available_presets = gr.Dropdown(choices=get_available_presets(), label="Load Preset", interactive=True)
-            save_preset_button = gr.Button("Save Preset")
-            delete_preset_button = gr.Button("Delete Preset")
-        with gr.Column():
-            pass # The fourth column is now empty
-    with gr.Row():
-        process_button = gr.Button("Process")
-        clear_list_button = gr.Button("Clear List")
-        clear_cache_button = gr.Button("Clear Cache Files")
-        open_cache_folder_button = gr.Button("Open Post-Processing Folder")
-
-    def update_uploaded_files(files):
-        return files
+def build_interface():
+    with gr.Blocks(theme='JohnSmith9982/small_and_pretty', delete_cache=GRADIO_CACHE_CLEANUP) as iface:
+        upload_paths_state = gr.State([])
+        output_format_state = gr.State("WAV")
+        file_info_state = gr.State([])
+        # Kept in the browser so a reload reconnects to the running job.
+        job_id_state = gr.BrowserState(None, storage_key="loudv1_job")
+        file_output = gr.Dataframe(headers=["Filename", "Processing Status", "Original LUFS", "Processed LUFS", "Duration", "Sample Rate", "Channels", *STATS_COLUMNS.values(), *METRICS_COLUMNS.values(), "Deliverable"])
+        metrics_summary = gr.Markdown()
+        job_status = gr.Markdown()
+        download_output = gr.Files(label="Download Processed Files")
+        with gr.Row():
+            with gr.Column():
+                audio_input = gr.File(file_types=["audio"], label="Upload audio files", file_count="multiple")
+            with gr.Column():
+                output_format_label_html = """
+                    <span title='**Output Format:** Select the file type to save the processed audio.\n\n* **WAV:** A lossless format that retains all audio details, offering the best quality but resulting in larger files, suitable for scenarios requiring the highest fidelity.\n* **AAC:** A lossy format that reduces file size through compression, providing good audio quality, suitable for network transmission and mobile devices.'>
+                        Output Format
+                    </span>
+                """
+                gr.HTML(output_format_label_html)
+                output_format = gr.Radio(["WAV", "AAC"], value="WAV", label="")
+                attack_label_html = """
+                    <span title='**Attack (ms):** The speed at which the dynamic range compressor starts reducing the volume after the audio signal's loudness exceeds the set Threshold. The unit is milliseconds (one-thousandth of a second).\n\n* **Function:** Affects the processing of sudden sounds (transients) in the audio. A shorter attack time can control sudden loud sounds, like drum hits, more quickly but might make the sound seem "muffled." A longer attack time preserves the impact of these sounds.\n* **Beginner Tip:** If your audio contains many sudden, sharp sounds, try a shorter attack time (e.g., 5ms). If you want to preserve the natural impact of sounds, try a longer attack time (e.g., 20ms).'>
+                        Attack (ms)
+                    </span>
+                """
+                gr.HTML(attack_label_html)
+                attack_input = gr.Number(value=5.0, label="")
+                release_label_html = """
+                    <span title='**Release (ms):** The speed at which the dynamic range compressor stops reducing the volume and returns to the original volume after the audio signal's loudness falls below the Threshold. The unit is milliseconds.\n\n* **Function:** Affects the smoothness of the compression process and the "breathing" of the sound. A shorter release time will cause the volume to recover quickly, which may lead to unnatural pumping or "breathing" effects. A longer release time makes volume changes smoother.\n* **Beginner Tip:** If your audio has a fast tempo, try a shorter release time (e.g., 50ms). If the tempo is slower, or you want more natural-sounding changes, try a longer release time (e.g., 150ms).'>
+                        Release (ms)
+                    </span>
+                """
+                gr.HTML(release_label_html)
+                release_input = gr.Number(value=50.0, label="")
+            with gr.Column():
+                target_loudness_label_html = """
+                    <span title='**Target Loudness (LUFS):** The overall loudness level you want the processed audio to achieve. LUFS is a unit for measuring audio loudness; the smaller the value, the quieter the sound.\n\n* **Function:** Unifies the volume of different audio files, preventing sudden changes in loudness during playback.\n* **Beginner Tip:** For online videos or music, common target loudness levels are between -16 LUFS and -14 LUFS. For podcasts or audiobooks, you can set it to -19 LUFS to -16 LUFS.'>
+                        Set Loudness Value -
+                    </span>
+                """
+                gr.HTML(target_loudness_label_html)
+                target_loudness_input = gr.Number(value=16, precision=0, label="")
+                threshold_label_html = """
+                    <span title='**Threshold (dBFS):** Sets a loudness "gate." When the audio signal's loudness exceeds this value, the dynamic range compressor starts working to reduce the volume. The unit is dBFS.\n\n* **Function:** Controls when the dynamic range compressor starts. Only sounds exceeding the threshold will be compressed.\n* **Beginner Tip:** You can set the threshold slightly below the loudest parts of your audio. For example, if the loudest part of the audio is -10 dBFS, you could try setting the threshold to -15 dBFS. Lowering the threshold will cause more sounds to be compressed.'>
+                        Threshold (dBFS)
+                    </span>
+                """
+                gr.HTML(threshold_label_html)
+                threshold_input = gr.Number(value=-20.0, label="")
+                ratio_label_html = """
+                    <span title='**Ratio:** Indicates the amount of compression applied when the audio signal's loudness exceeds the Threshold. For example, a ratio of 2:1 means that if the sound exceeds the threshold by 2 decibels, it will only increase by 1 decibel.\n\n* **Function:** Controls the degree of dynamic range reduction. A higher ratio will make the dynamic range smaller and the sound more "compact."\n* **Beginner Tip:** If you only want to slightly control volume fluctuations, use a lower ratio (e.g., 2:1 or 3:1). If you need to reduce the dynamic range more significantly, use a higher ratio (e.g., 4:1 or higher).'>
+                        Ratio
+                    </span>
+                """
+                gr.HTML(ratio_label_html)
+                ratio_input = gr.Number(value=2.0, label="")
+            with gr.Column():
+                peak_limit_target_label_html = """
+                    <span title='**Peak Limit Target (dBFS):** Sets the maximum loudness level allowed for the processed audio. The unit is dBFS; the limiter measures true peak (dBTP), which includes the peaks between samples.\n\n* **Function:** Prevents audio signal overload (causing clipping or distortion), ensuring sound quality. A look-ahead limiter runs after the loudness adjustment and only turns down the peaks that would exceed this value.\n* **Beginner Tip:** Usually set to a value slightly below 0 dBFS, such as -1 dBFS or -2 dBFS. 0 dBFS is the maximum volume for digital audio; exceeding this value can lead to clipping distortion.'>
+                        Peak Limit Target (dBFS)
+                    </span>
+                """
+                gr.HTML(peak_limit_target_label_html)
+                peak_limit_target_input = gr.Number(value=-3.0, label="")
+                limiter_lookahead_label_html = """
+                    <span title='**Limiter Look-ahead (ms):** How far ahead the peak limiter looks for peaks, in milliseconds. The volume is turned down gradually over this time before a peak arrives.\n\n* **Function:** Longer look-ahead makes the limiting smoother and less audible; shorter look-ahead keeps more of the punch of transients.\n* **Beginner Tip:** The default (5ms) suits most material. Try 1-2ms for percussive music; the minimum is 1ms, as shorter look-aheads let peaks between samples through.'>
+                        Limiter Look-ahead (ms)
+                    </span>
+                """
+                gr.HTML(limiter_lookahead_label_html)
+                limiter_lookahead_input = gr.Number(value=DEFAULT_LOOKAHEAD, minimum=MIN_LOOKAHEAD, label="")
+                limiter_release_label_html = """
+                    <span title='**Limiter Release (ms):** How quickly the peak limiter lets the volume recover after a peak, in milliseconds.\n\n* **Function:** A short release recovers loudness quickly but can cause audible distortion or pumping; a long release is smoother but keeps the volume down for longer after each peak.\n* **Beginner Tip:** The default (50ms) suits most material. Try 100-200ms for speech or classical music.'>
+                        Limiter Release (ms)
+                    </span>
+                """
+                gr.HTML(limiter_release_label_html)
+                limiter_release_input = gr.Number(value=DEFAULT_RELEASE, minimum=0, label="")
+                preset_name_input = gr.Textbox(label="Preset Name")
+                available_presets = gr.Dropdown(choices=get_available_presets(), label="Load Preset", interactive=True)
+                save_preset_button = gr.Button("Save Preset")
+                delete_preset_button = gr.Button("Delete Preset")
+            with gr.Column():
+                max_workers_label_html = """
+                    <span title='**Parallel Workers:** How many files of this job are processed at the same time, each in its own process.\n\n* **Function:** Uses more CPU cores to finish large batches sooner. Larger files are started first. All jobs share one pool of worker processes (LOUDV1_WORKERS, the number of CPU cores by default) and up to LOUDV1_MAX_JOBS jobs run at once, so this is capped at the pool size.\n* **Beginner Tip:** Keep the default unless the computer becomes unresponsive or runs out of memory; then lower it.'>
+                        Parallel Workers
+                    </span>
+                """
+                gr.HTML(max_workers_label_html)
+                max_workers_input = gr.Number(value=MAX_WORKERS, precision=0, minimum=1, label="")
+                quick_estimate_label_html = """
+                    <span title='**Quick Loudness Estimate:** Estimates the original loudness of uploaded files from a sample of about a tenth of each file instead of measuring all of it.\n\n* **Function:** Speeds up checking large libraries. The estimate is shown with its error bound (95% confidence, in LU); processing still measures the exact value.\n* **Beginner Tip:** Leave it off for normal use. Turn it on to quickly sort through many long recordings.'>
+                        Quick Loudness Estimate
+                    </span>
+                """
+                gr.HTML(quick_estimate_label_html)
+                quick_estimate_input = gr.Checkbox(value=False, label="")
+                deliverables_label_html = """
+                    <span title='**Deliverables:** Several versions of every file in one run, one per line as target LUFS, peak limit target (dBTP) and output format, e.g. "-14, -1, AAC". The peak and format can be left out to use the settings on the left.\n\n* **Function:** Each file is decoded and compressed once; every deliverable only adds its own loudness gain, peak limiting and encoding, so three deliverables take far less than three runs. The table shows one row per file and deliverable.\n* **Beginner Tip:** Leave empty to process with the single target on the left. Presets picked under "Deliverable Presets" are added as deliverables too, with their own target and format if they were saved with them; their compression settings are not used.'>
+                        Deliverables
+                    </span>
+                """
+                gr.HTML(deliverables_label_html)
+                deliverables_input = gr.Textbox(lines=3, placeholder="-14, -1, AAC\n-16, -1, WAV\n-23, -1, WAV", label="")
+                deliverable_presets_input = gr.Dropdown(choices=get_available_presets(), multiselect=True, label="Deliverable Presets", interactive=True)
+        with gr.Row():
+            process_button = gr.Button("Process")
+            cancel_job_button = gr.Button("Cancel Job")
+            clear_list_button = gr.Button("Clear List")
+            clear_cache_button = gr.Button("Clear Cache Files")
+            open_cache_folder_button = gr.Button("Open Post-Processing Folder")
 
-    audio_input.upload(update_uploaded_files, inputs=audio_input, outputs=uploaded_files_state, queue=False)
-    audio_input.upload(on_file_upload, inputs=[audio_input, file_info_state], outputs=[file_output, file_info_state], queue=False)
-    output_format.change(lambda x: x, inputs=output_format, outputs=output_format_state)
-    process_button.click(
-        process_all,
-        inputs=[file_info_state, uploaded_files_state, output_format_state, target_loudness_input, threshold_input, ratio_input, attack_input, release_input, peak_limit_target_input],
-        outputs=[file_output, download_output],
-    )
-    delete_preset_button.click(
-        delete_preset,
-        inputs=[available_presets],
-        outputs=[available_presets],
-    )
-    save_preset_button.click(
-        save_preset,
-        inputs=[preset_name_input, threshold_input, ratio_input, attack_input, release_input, peak_limit_target_input],
-        outputs=[available_presets],
-    )
-    available_presets.change(
-        load_preset,
-        inputs=[available_presets],
-        outputs=[threshold_input, ratio_input, attack_input, release_input, peak_limit_target_input],
-    )
-    clear_list_button.click(
-        clear_list,
-        inputs=file_info_state,
-        outputs=[file_output, file_info_state, download_output, audio_input]
-    )
-    clear_cache_button.click(clear_cache)
-    open_cache_folder_button.click(open_post_processing_folder)
+        # Events that wait on the shared worker pool don't hold a queue slot
+        # each, so one session's batch never blocks another session's page.
+        scan_event = audio_input.upload(on_file_upload, inputs=[audio_input, file_info_state, quick_estimate_input, max_workers_input], outputs=[file_output, file_info_state, upload_paths_state],
+                                        concurrency_limit=None)
+        output_format.change(lambda x: x, inputs=output_format, outputs=output_format_state)
+        # Processing takes over the table, so a loudness scan still running is
+        # cancelled; process_all measures the values it did not get to.
+        process_button.click(
+            process_all,
+            inputs=[file_info_state, upload_paths_state, output_format_state, target_loudness_input, threshold_input, ratio_input, attack_input, release_input, peak_limit_target_input, limiter_lookahead_input, limiter_release_input, max_workers_input, deliverables_input, deliverable_presets_input],
+            outputs=[file_output, download_output, metrics_summary, job_id_state, job_status],
+            cancels=[scan_event],
+            concurrency_limit=None,
+        )
+        cancel_job_button.click(cancel_job, inputs=job_id_state, outputs=job_status)
+        delete_preset_button.click(
+            delete_preset,
+            inputs=[available_presets],
+            outputs=[available_presets],
+        )
+        save_preset_button.click(
+            save_preset,
+            inputs=[preset_name_input, threshold_input, ratio_input, attack_input, release_input, peak_limit_target_input, limiter_lookahead_input, limiter_release_input,
+                    target_loudness_input, output_format],
+            outputs=[available_presets],
+        )
+        available_presets.change(
+            load_preset,
+            inputs=[available_presets],
+            outputs=[threshold_input, ratio_input, attack_input, release_input, peak_limit_target_input, limiter_lookahead_input, limiter_release_input,
+                     target_loudness_input, output_format],
+        )
+        # presets may have been saved or deleted since the page was built
+        deliverable_presets_input.focus(refresh_presets, outputs=deliverable_presets_input)
+        clear_list_button.click(
+            clear_list,
+            inputs=[file_info_state, job_id_state],
+            outputs=[file_output, file_info_state, upload_paths_state, download_output, audio_input, metrics_summary, job_id_state, job_status],
+            cancels=[scan_event],
+        )
+        clear_cache_button.click(clear_cache, outputs=job_status)
+        open_cache_folder_button.click(open_post_processing_folder, inputs=job_id_state)
+        iface.load(follow_job, inputs=job_id_state, outputs=[file_output, download_output, metrics_summary, job_id_state, job_status],
+                   concurrency_limit=None)
+    return iface
 
-iface.launch()
+if __name__ == "__main__":
+    build_interface().launch()
@@ -0,0 +1,235 @@
+import numpy as np
+import pyloudnorm as pyln
+import scipy.signal
+
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+BLOCK_SECONDS = 0.4
+STEP_SECONDS = 0.1
+# Short-term loudness window and the loudness range gates (EBU Tech 3341/3342).
+SHORT_TERM_SECONDS = 3.0
+LRA_RELATIVE_GATE = -20.0
+LRA_LOW_PERCENTILE = 10
+LRA_HIGH_PERCENTILE = 95
+# True peak is measured on a 4x oversampled signal (ITU-R BS.1770-4 Annex 2)
+# using a 48-tap interpolation filter, split into one 12-tap filter per phase.
+TRUE_PEAK_OVERSAMPLING = 4
+TRUE_PEAK_TAPS = 48
+TRUE_PEAK_CHUNK_FRAMES = 1 << 14
+# Block powers are kept exactly for the first EXACT_BLOCK_LIMIT blocks (about
+# 1.8 hours); longer inputs switch to a histogram so memory does not grow with
+# the length of the input. The bin width bounds the error of the relative gate
+# (well below 0.01 LU at that length).
+EXACT_BLOCK_LIMIT = 1 << 16
+HISTOGRAM_MIN = ABSOLUTE_GATE
+HISTOGRAM_MAX = 30.0
+HISTOGRAM_BIN = 0.01
+
+
+def channel_weights(channels):
+    # pyloudnorm's weights for L, R, C, Ls, Rs; 5.1 (L, R, C, LFE, Ls, Rs)
+    # drops the LFE channel as in ITU-R BS.1770.
+    if channels == 6:
+        return np.array([1.0, 1.0, 1.0, 0.0, 1.41, 1.41])
+    weights = [1.0, 1.0, 1.0, 1.41, 1.41]
+    return np.array((weights + [1.0] * channels)[:channels])
+
+
+def power_to_lufs(power):
+    with np.errstate(divide="ignore"):
+        return -0.691 + 10.0 * np.log10(power)
+
+
+def amplitude_to_db(amplitude):
+    return 20 * np.log10(amplitude) if amplitude > 0 else -float("inf")
+
+
+def true_peak_matrix():
+    """(taps per phase, phases) matrix of the reversed polyphase interpolation filters."""
+    taps = scipy.signal.firwin(TRUE_PEAK_TAPS, 1.0 / TRUE_PEAK_OVERSAMPLING, fs=2.0) * TRUE_PEAK_OVERSAMPLING
+    return np.stack([taps[phase::TRUE_PEAK_OVERSAMPLING][::-1] for phase in range(TRUE_PEAK_OVERSAMPLING)], axis=1).astype(np.float32)
+
+
+def loudness_range(short_term):
+    """Loudness range (LRA, EBU Tech 3342) of a series of short-term loudness values."""
+    short_term = short_term[short_term > ABSOLUTE_GATE]
+    if not len(short_term):
+        return 0.0
+    relative_gate = power_to_lufs(np.mean(10 ** ((short_term + 0.691) / 10))) + LRA_RELATIVE_GATE
+    short_term = short_term[short_term > relative_gate]
+    low, high = np.percentile(short_term, [LRA_LOW_PERCENTILE, LRA_HIGH_PERCENTILE])
+    return float(high - low)
+
+
+class LoudnessMeter:
+    """Incremental ITU-R BS.1770 / EBU R128 loudness meter.
+
+    Feed float32 (frames, channels) blocks of any size to `process`; the
+    K-weighting and oversampling filter states and the partial gating block are
+    carried between calls, so one pass yields integrated loudness, the
+    momentary (400 ms) and short-term (3 s) loudness series at 100 ms steps,
+    the loudness range, sample peak and true peak. Uses pyloudnorm's filter
+    coefficients and gating constants.
+    """
+
+    def __init__(self, frame_rate, channels):
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.weights = channel_weights(channels)
+        self.step_frames = int(round(STEP_SECONDS * frame_rate))
+        self.steps_per_block = int(round(BLOCK_SECONDS / STEP_SECONDS))
+        self.block_frames = self.step_frames * self.steps_per_block
+        self.short_term_steps = int(round(SHORT_TERM_SECONDS / STEP_SECONDS))
+
+        filters = pyln.Meter(frame_rate)._filters.values()
+        self._filters = [(f.b, f.a, f.passband_gain) for f in filters]
+        self._filter_state = [np.zeros((max(len(a), len(b)) - 1, channels)) for b, a, _ in self._filters]
+        self._true_peak_matrix = true_peak_matrix()
+        self._true_peak_history = np.zeros((len(self._true_peak_matrix) - 1, channels), dtype=np.float32)
+        self.reset_gating()
+        self.frames = 0
+        self.sample_peak = 0.0
+        self.true_peak = 0.0
+
+    def reset_gating(self):
+        """Forget the loudness blocks measured so far but keep the filter state.
+
+        Used after feeding a pre-roll so a measurement that starts mid-file is
+        not skewed by the filters settling.
+        """
+        self._block_powers = []
+        self._block_count = 0
+        self._histogram_count = None
+        self._histogram_power = None
+        self._pending = np.zeros((0, self.channels))
+        self._step_powers = np.zeros(0)
+        self._momentary = []
+        self._short_term = []
+
+    def k_weight(self, samples):
+        data = samples.astype(np.float64)
+        for i, (b, a, gain) in enumerate(self._filters):
+            data, self._filter_state[i] = scipy.signal.lfilter(b, a, data, axis=0, zi=self._filter_state[i])
+            if gain != 1.0:
+                data *= gain
+        return data
+
+    def oversampled_peak(self, samples):
+        # All phases of the polyphase interpolator at once: every input frame
+        # and the frames before it, as a window, times the filter matrix gives
+        # the oversampled frames that follow it.
+        taps = len(self._true_peak_matrix)
+        padded = np.concatenate((self._true_peak_history, samples))
+        self._true_peak_history = padded[len(padded) - taps + 1:].copy()
+        peak = 0.0
+        for start in range(0, len(samples), TRUE_PEAK_CHUNK_FRAMES):
+            windows = np.lib.stride_tricks.sliding_window_view(padded[start:start + TRUE_PEAK_CHUNK_FRAMES + taps - 1], taps, axis=0)
+            peak = max(peak, float(np.max(np.abs(windows @ self._true_peak_matrix))))
+        return peak
+
+    def process(self, samples):
+        if not len(samples):
+            return
+        self.frames += len(samples)
+        self.sample_peak = max(self.sample_peak, float(np.max(np.abs(samples))))
+        self.true_peak = max(self.true_peak, self.sample_peak, self.oversampled_peak(samples))
+        weighted = np.concatenate((self._pending, self.k_weight(samples)))
+        steps = len(weighted) // self.step_frames
+        used = steps * self.step_frames
+        self._pending = weighted[used:]
+        if not steps:
+            return
+        chunks = weighted[:used].reshape(steps, self.step_frames, self.channels)
+        step_powers = np.einsum("ijk,ijk->ik", chunks, chunks) @ self.weights
+        history = np.concatenate((self._step_powers, step_powers))
+        momentary = self._window_powers(history, self.steps_per_block)
+        if len(momentary):
+            self._momentary.append(momentary)
+            self._add_blocks(momentary)
+        short_term = self._window_powers(history, self.short_term_steps)
+        if len(short_term):
+            self._short_term.append(short_term)
+        keep = max(self.steps_per_block, self.short_term_steps) - 1
+        self._step_powers = history[max(0, len(history) - keep):]
+
+    def _window_powers(self, history, window):
+        # Mean power of every `window`-step window that ends in a new step
+        start = max(0, len(self._step_powers) - window + 1)
+        if len(history) - start < window:
+            return np.zeros(0)
+        windows = np.lib.stride_tricks.sliding_window_view(history[start:], window)
+        return windows.sum(axis=1) / (window * self.step_frames)
+
+    def _add_blocks(self, powers):
+        powers = powers[power_to_lufs(powers) > ABSOLUTE_GATE]
+        self._block_count += len(powers)
+        if self._histogram_count is None:
+            self._block_powers.append(powers)
+            if self._block_count <= EXACT_BLOCK_LIMIT:
+                return
+            powers = np.concatenate(self._block_powers)
+            self._block_powers = []
+            bins = int(round((HISTOGRAM_MAX - HISTOGRAM_MIN) / HISTOGRAM_BIN))
+            self._histogram_count = np.zeros(bins, dtype=np.int64)
+            self._histogram_power = np.zeros(bins)
+        index = ((power_to_lufs(powers) - HISTOGRAM_MIN) / HISTOGRAM_BIN).astype(np.int64)
+        index = np.clip(index, 0, len(self._histogram_count) - 1)
+        np.add.at(self._histogram_count, index, 1)
+        np.add.at(self._histogram_power, index, powers)
+
+    def block_powers(self):
+        """Channel-weighted powers of the blocks above the absolute gate (exact mode only)."""
+        if self._histogram_count is not None:
+            raise ValueError("Block powers are only kept for the first EXACT_BLOCK_LIMIT blocks")
+        return np.concatenate(self._block_powers) if self._block_powers else np.zeros(0)
+
+    def _gated_powers(self):
+        # (loudness, count, power) of the absolutely gated blocks or histogram bins
+        if self._histogram_count is None:
+            powers = self.block_powers()
+            return power_to_lufs(powers), np.ones(len(powers), dtype=np.int64), powers
+        centres = HISTOGRAM_MIN + (np.arange(len(self._histogram_count)) + 0.5) * HISTOGRAM_BIN
+        return centres, self._histogram_count, self._histogram_power
+
+    def integrated_loudness(self):
+        if not self._block_count:
+            return -float("inf")
+        loudness, counts, powers = self._gated_powers()
+        relative_gate = power_to_lufs(powers.sum() / self._block_count) + RELATIVE_GATE
+        kept = loudness > relative_gate
+        count = counts[kept].sum()
+        if not count:
+            return -float("inf")
+        return float(power_to_lufs(powers[kept].sum() / count))
+
+    def momentary_loudness(self):
+        """Momentary loudness (400 ms window) in LUFS at 100 ms steps."""
+        return power_to_lufs(np.concatenate(self._momentary)) if self._momentary else np.zeros(0)
+
+    def short_term_loudness(self):
+        """Short-term loudness (3 s window) in LUFS at 100 ms steps."""
+        return power_to_lufs(np.concatenate(self._short_term)) if self._short_term else np.zeros(0)
+
+    def loudness_range(self):
+        return loudness_range(self.short_term_loudness())
+
+    @property
+    def sample_peak_dbfs(self):
+        return amplitude_to_db(self.sample_peak)
+
+    @property
+    def true_peak_dbtp(self):
+        return amplitude_to_db(self.true_peak)
+
+    def stats(self):
+        """Summary of the measurement as a JSON-friendly dict."""
+        momentary = self.momentary_loudness()
+        short_term = self.short_term_loudness()
+        return {
+            "integrated": self.integrated_loudness(),
+            "momentary_max": float(momentary.max()) if len(momentary) else -float("inf"),
+            "short_term_max": float(short_term.max()) if len(short_term) else -float("inf"),
+            "lra": loudness_range(short_term),
+            "sample_peak": float(self.sample_peak_dbfs),
+            "true_peak": float(self.true_peak_dbtp),
+        }
@@ -0,0 +1,99 @@
+import numpy as np
+
+# Samples converted per pass by float_to_pcm, bounds its scratch buffers.
+CONVERSION_CHUNK = 1 << 16
+
+
+def full_scale(sample_width):
+    return 2 ** (8 * sample_width - 1)
+
+
+def pcm_to_float(raw, sample_width, channels, float_format=False, signed_8bit=False):
+    """Convert little-endian PCM bytes to float32 (frames, channels) in [-1.0, 1.0].
+
+    `raw` is read through a np.frombuffer view (bytes, bytearray, memoryview or
+    AudioSegment.raw_data) and the result is the only array allocated: 24-bit
+    samples are unpacked inside it before being converted in place. 8-bit PCM
+    is unsigned as in WAV files unless `signed_8bit` is set, as in pydub.
+    """
+    if float_format:
+        data = np.frombuffer(raw, dtype="<f4" if sample_width == 4 else "<f8")
+        out = np.empty(len(data), dtype=np.float32)
+        np.copyto(out, data, casting="same_kind")
+        return out.reshape(-1, channels)
+
+    scale = np.float32(1.0 / full_scale(sample_width))
+    if sample_width == 3:
+        frames = len(raw) // 3
+        out = np.empty(frames, dtype=np.float32)
+        # Read every sample as the int32 starting at its first byte (the next
+        # sample's first byte lands in the top bits) and shift it left so the
+        # 24 bits fill the int32 in place of the output. The last sample has no
+        # byte after it and is read on its own.
+        wide = out.view("<i4")
+        if frames:
+            overlapping = np.ndarray(shape=(frames - 1,), dtype="<i4", buffer=raw, strides=(3,))
+            np.left_shift(overlapping, 8, out=wide[:-1])
+            wide[-1] = int.from_bytes(bytes(raw[3 * frames - 3:3 * frames]), "little", signed=True) << 8
+        # numpy copies an overlapping input whole, so convert chunk by chunk
+        for start in range(0, frames, CONVERSION_CHUNK):
+            end = start + CONVERSION_CHUNK
+            np.multiply(wide[start:end], np.float32(1.0 / 2 ** 31), out=out[start:end], dtype=np.float32, casting="unsafe")
+        return out.reshape(-1, channels)
+
+    if sample_width == 1:
+        data = np.frombuffer(raw, dtype=np.int8 if signed_8bit else np.uint8)
+        out = np.empty(len(data), dtype=np.float32)
+        if signed_8bit:
+            np.multiply(data, scale, out=out, dtype=np.float32)
+        else:
+            np.subtract(data, np.float32(128.0), out=out, dtype=np.float32)
+            out *= scale
+        return out.reshape(-1, channels)
+
+    data = np.frombuffer(raw, dtype=f"<i{sample_width}")
+    out = np.empty(len(data), dtype=np.float32)
+    # Scaling by a power of two is exact, so casting int32 to float32 first
+    # rounds only once.
+    np.multiply(data, scale, out=out, dtype=np.float32, casting="unsafe")
+    return out.reshape(-1, channels)
+
+
+def float_to_pcm(samples, sample_width, out=None, signed_8bit=False):
+    """Convert float32 samples to little-endian PCM bytes, clipping at full scale.
+
+    Writes into `out` (any writable buffer of the right size, e.g. a bytearray
+    handed to AudioSegment) or a new array and returns the bytes as a uint8
+    array. Works through small scratch buffers, so apart from the output no
+    array the size of the input is allocated.
+    """
+    flat = np.ascontiguousarray(samples).reshape(-1)
+    size = flat.size * sample_width
+    out = np.empty(size, dtype=np.uint8) if out is None else np.frombuffer(out, dtype=np.uint8)
+    if len(out) != size:
+        raise ValueError(f"Output buffer holds {len(out)} bytes, {size} needed")
+    scale = full_scale(sample_width)
+    # 2**31 - 1 is not representable in float32, 32-bit PCM is rounded in float64.
+    scratch = np.empty(min(flat.size, CONVERSION_CHUNK), dtype=np.float64 if sample_width == 4 else np.float32)
+    wide = np.empty(len(scratch), dtype="<i4") if sample_width == 3 else None
+    for start in range(0, flat.size, CONVERSION_CHUNK):
+        part = flat[start:start + CONVERSION_CHUNK]
+        values = scratch[:len(part)]
+        np.multiply(part, scale, out=values)
+        np.rint(values, out=values)
+        np.clip(values, -scale, scale - 1, out=values)
+        target = out[start * sample_width:(start + len(part)) * sample_width]
+        if sample_width == 1:
+            if signed_8bit:
+                np.copyto(target.view(np.int8), values, casting="unsafe")
+            else:
+                np.add(values, 128, out=target, casting="unsafe")
+        elif sample_width == 3:
+            packed = wide[:len(part)]
+            np.copyto(packed, values, casting="unsafe")
+            # byte by byte: three 1-D strided copies beat one (n, 3) copy
+            for byte in range(3):
+                target[byte::3] = packed.view(np.uint8)[byte::4]
+        else:
+            np.copyto(target.view(f"<i{sample_width}"), values, casting="unsafe")
+    return out
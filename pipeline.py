@@ -0,0 +1,284 @@
+from pydub import AudioSegment
+import os
+import numpy as np
+from compressor import compress_dynamic_range
+from deliverables import Deliverable
+from instrumentation import count, measure_file, record_cache, set_audio_seconds, stage
+from limiter import DEFAULT_LOOKAHEAD, DEFAULT_RELEASE, Limiter, limiter_makeup_gain
+from meter import LoudnessMeter
+from pcm import pcm_to_float
+from streaming import STREAM_BLOCK_SECONDS, measure_lufs, normalize_gain, open_writer, process_streaming, should_stream
+from wavfile import WavReader
+
+
+class DecodedAudio:
+    """One decoded file shared by every stage of the pipeline.
+
+    `samples` is a float32 array shaped (frames, channels) scaled to [-1.0, 1.0];
+    stages read it and update it in place. `sample_width` is the width of the
+    decoded PCM and is used again when the result is exported.
+    """
+
+    def __init__(self, samples, frame_rate, sample_width, source_path=None, original_lufs=None):
+        self.samples = samples
+        self.frame_rate = frame_rate
+        self.sample_width = sample_width
+        self.source_path = source_path
+        # Loudness of the source before any processing, when it was measured.
+        self.original_lufs = original_lufs
+
+    @property
+    def channels(self):
+        return self.samples.shape[1]
+
+    @property
+    def frame_count(self):
+        return self.samples.shape[0]
+
+    @property
+    def duration_seconds(self):
+        return self.frame_count / self.frame_rate if self.frame_rate else 0.0
+
+    def copy(self):
+        return DecodedAudio(self.samples.copy(), self.frame_rate, self.sample_width, self.source_path, self.original_lufs)
+
+
+def segment_to_float(audio):
+    # pydub keeps 8-bit audio signed
+    return pcm_to_float(audio.raw_data, audio.sample_width, audio.channels, signed_8bit=True)
+
+
+def decode_audio(path):
+    # WAV is read directly, keeping its sample width as streaming mode does;
+    # pydub widens 24-bit samples to 32-bit in Python, which is far slower.
+    try:
+        reader = WavReader(path)
+    except Exception:
+        reader = None
+    if reader is not None:
+        with reader:
+            decoded = DecodedAudio(reader.read(reader.frame_count), reader.frame_rate, reader.sample_width, source_path=path)
+    else:
+        audio = AudioSegment.from_file(path)
+        decoded = DecodedAudio(segment_to_float(audio), audio.frame_rate, audio.sample_width, source_path=path)
+    count("bytes_decoded", decoded.samples.nbytes)
+    return decoded
+
+
+def save_decoded(decoded, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        original_lufs = np.nan if decoded.original_lufs is None else decoded.original_lufs
+        np.savez(f, samples=decoded.samples, frame_rate=decoded.frame_rate, sample_width=decoded.sample_width, original_lufs=original_lufs)
+    os.replace(temp_path, path)
+
+
+def load_decoded(path, source_path=None):
+    with np.load(path) as data:
+        original_lufs = float(data["original_lufs"]) if "original_lufs" in data else np.nan
+        return DecodedAudio(data["samples"], int(data["frame_rate"]), int(data["sample_width"]), source_path=source_path,
+                            original_lufs=None if np.isnan(original_lufs) else original_lufs)
+
+
+def calculate_lufs(audio_file_path):
+    try:
+        return measure_lufs(audio_file_path)
+    except Exception as e:
+        return f"Unable to calculate LUFS: {str(e)}"
+
+
+def iter_blocks(decoded, block_seconds=STREAM_BLOCK_SECONDS):
+    block_frames = max(1, int(block_seconds * decoded.frame_rate))
+    for start in range(0, decoded.frame_count, block_frames):
+        yield decoded.samples[start:start + block_frames]
+
+
+def analyze_loudness(decoded):
+    """Run a meter.LoudnessMeter over the buffer in one pass and return it."""
+    meter = LoudnessMeter(decoded.frame_rate, decoded.channels)
+    # Metered block by block so the float64 filter buffers stay small.
+    for block in iter_blocks(decoded):
+        meter.process(block)
+    return meter
+
+
+def measure_loudness(decoded):
+    return analyze_loudness(decoded).integrated_loudness()
+
+
+def compress(decoded, threshold, ratio, attack, release):
+    compress_dynamic_range(decoded.samples, decoded.frame_rate, threshold=threshold, ratio=ratio,
+                           attack=attack, release=release, out=decoded.samples)
+
+
+def rendered_blocks(decoded, gain, limiter=None):
+    """Apply `gain` (linear) and then `limiter` to the buffer block by block, yielding each finished block.
+
+    The gain is applied in place; with a limiter.Limiter the yielded blocks lag
+    the buffer by its latency and the last one is its flush.
+    """
+    for block in iter_blocks(decoded):
+        with stage("gain"):
+            block *= gain
+        if limiter is not None:
+            with stage("limit"):
+                block = limiter.process(block)
+        yield block
+    if limiter is not None:
+        with stage("limit"):
+            block = limiter.flush()
+        yield block
+
+
+def render_audio(decoded, output_path, output_format, target_loudness, peak_limit_target,
+                 limiter_lookahead=DEFAULT_LOOKAHEAD, limiter_release=DEFAULT_RELEASE, meter=None):
+    """Loudness normalization -> peak limit -> export of a compressed buffer.
+
+    The buffer is rendered block by block (see rendered_blocks) and each
+    block goes to the writer as soon as it is done: WAV is converted to PCM
+    and written straight to disk, other formats are piped to an ffmpeg encoder
+    running alongside (see streaming.open_writer), so encoding overlaps with
+    the gain and limiter of the next blocks. The buffer is left with only the
+    gain applied, and the file only appears at `output_path` once it is
+    complete. Returns the loudness stats (see
+    meter.LoudnessMeter.stats) of the output, measured while it is written.
+    The limiter runs after the loudness gain, so the output meets the ceiling
+    whatever the gain. When the limiter will engage, the loudness it takes
+    away is measured in trial passes and made up before the final render;
+    otherwise the limiter is skipped, as it would leave the buffer unchanged.
+    `meter` is the analyze_loudness result of the buffer if it was measured
+    already.
+    """
+    if meter is None:
+        with stage("measure"):
+            meter = analyze_loudness(decoded)
+    gain_db = normalize_gain(meter, target_loudness)
+    limit = meter.true_peak_dbtp + gain_db > peak_limit_target
+    if limit:
+        with stage("limiter_makeup"):
+            gain_db += limiter_makeup_gain(lambda: iter_blocks(decoded), decoded.frame_rate, decoded.channels, gain_db, target_loudness,
+                                           peak_limit_target, limiter_lookahead, limiter_release)
+    gain = np.float32(10 ** (gain_db / 20))
+    limiter = Limiter(decoded.frame_rate, decoded.channels, peak_limit_target, limiter_lookahead, limiter_release) if limit else None
+    output_meter = LoudnessMeter(decoded.frame_rate, decoded.channels)
+    with open_writer(output_path, output_format, decoded) as writer:
+        for block in rendered_blocks(decoded, gain, limiter):
+            with stage("export"):
+                output_meter.process(block)
+                writer.write(block)
+        # waits for the encoder to finish
+        with stage("export"):
+            writer.close()
+    return output_meter.stats()
+
+
+def load_compressed(input_path, threshold, ratio, attack, release, decoded_cache_path=None, compressed_cache_path=None,
+                    measure_original=False):
+    """Decoded and compressed audio for `input_path`, reusing cached intermediates.
+
+    Intermediates missing from the cache paths are written there for next time.
+    With `measure_original`, the loudness of the uncompressed audio is stored in
+    `original_lufs` (a cached compressed intermediate keeps it if it had it).
+    """
+    if compressed_cache_path:
+        record_cache("compressed", os.path.exists(compressed_cache_path))
+        if os.path.exists(compressed_cache_path):
+            with stage("cache_load"):
+                return load_decoded(compressed_cache_path, source_path=input_path)
+    if decoded_cache_path:
+        record_cache("decoded", os.path.exists(decoded_cache_path))
+    if decoded_cache_path and os.path.exists(decoded_cache_path):
+        with stage("cache_load"):
+            decoded = load_decoded(decoded_cache_path, source_path=input_path)
+    else:
+        with stage("decode"):
+            decoded = decode_audio(input_path)
+        if decoded_cache_path:
+            with stage("cache_save"):
+                save_decoded(decoded, decoded_cache_path)
+    if measure_original and decoded.original_lufs is None:
+        with stage("measure_original"):
+            decoded.original_lufs = measure_loudness(decoded)
+    with stage("compress"):
+        compress(decoded, threshold, ratio, attack, release)
+    if compressed_cache_path:
+        with stage("cache_save"):
+            save_decoded(decoded, compressed_cache_path)
+    return decoded
+
+
+def process_single_audio(input_path, output_path, output_format, target_loudness, threshold, ratio, attack, release, peak_limit_target,
+                         limiter_lookahead=DEFAULT_LOOKAHEAD, limiter_release=DEFAULT_RELEASE, streaming=None, decoded_cache_path=None, compressed_cache_path=None, measure_original=False):
+    """Process one file end to end; safe to run in a worker process.
+
+    The one-deliverable case of process_deliverables. Returns (status,
+    output_path, original_lufs, processed_stats, metrics), where original_lufs
+    is only measured with `measure_original`, processed_stats is the
+    meter.LoudnessMeter.stats dict of the output and metrics the
+    instrumentation.FileMetrics dict of the run; failures are reported
+    through the status instead of raising, so one bad file does not abort a
+    batch.
+    """
+    deliverable = Deliverable(target_loudness, peak_limit_target, output_format, limiter_lookahead, limiter_release)
+    results, original_lufs, metrics = process_deliverables(input_path, [deliverable], [output_path], threshold, ratio, attack, release, streaming,
+                                                           decoded_cache_path, compressed_cache_path, measure_original)
+    status, output_path, processed_stats = results[0]
+    return status, output_path, original_lufs, processed_stats, metrics
+
+
+def process_deliverables(input_path, deliverables, output_paths, threshold, ratio, attack, release, streaming=None,
+                         decoded_cache_path=None, compressed_cache_path=None, measure_original=False):
+    """Process one file into several deliverables.Deliverable outputs; safe to run in a worker process.
+
+    The file is decoded, compressed and measured once, then each deliverable
+    is rendered from a copy of the compressed buffer with only its gain,
+    limiter and encoder. Files too large to decode whole (see
+    streaming.STREAMING_THRESHOLD_BYTES) are processed block by block unless
+    `streaming` is given explicitly, and read again for every deliverable;
+    other files reuse or fill the decoded/compressed intermediates at the
+    cache paths. Returns (results, original_lufs, metrics), with a (status,
+    output_path, processed_stats) tuple in `results` for each deliverable; as
+    in process_single_audio, failures are reported through the status.
+    """
+    print(f"process_deliverables: Processing file: {input_path}, {len(deliverables)} deliverables")
+    results = []
+    original_lufs = None
+    with measure_file(input_path) as metrics:
+        try:
+            count("bytes_read", os.path.getsize(input_path))
+            if streaming is None:
+                streaming = should_stream(input_path)
+            decoded = meter = None
+            if not streaming:
+                decoded = load_compressed(input_path, threshold, ratio, attack, release, decoded_cache_path, compressed_cache_path, measure_original)
+                set_audio_seconds(decoded.duration_seconds)
+                original_lufs = decoded.original_lufs
+                with stage("measure"):
+                    meter = analyze_loudness(decoded)
+        except Exception as e:
+            print(f"process_deliverables: Processing failed: {str(e)}")
+            results = [(f"Processing failed: {str(e)}", None, None)] * len(deliverables)
+        else:
+            for number, (deliverable, output_path) in enumerate(zip(deliverables, output_paths)):
+                try:
+                    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+                    if streaming:
+                        lufs, processed_stats = process_streaming(input_path, output_path, deliverable.output_format, deliverable.target_loudness,
+                                                                  threshold, ratio, attack, release, deliverable.peak_limit_target,
+                                                                  deliverable.limiter_lookahead, deliverable.limiter_release,
+                                                                  measure_original=measure_original and original_lufs is None)
+                        original_lufs = original_lufs if lufs is None else lufs
+                    else:
+                        # the last deliverable can render into the shared buffer itself
+                        rendered = decoded if number == len(deliverables) - 1 else decoded.copy()
+                        processed_stats = render_audio(rendered, output_path, deliverable.output_format, deliverable.target_loudness,
+                                                       deliverable.peak_limit_target, deliverable.limiter_lookahead,
+                                                       deliverable.limiter_release, meter=meter)
+                    count("bytes_encoded", os.path.getsize(output_path))
+                    print(f"process_deliverables: {deliverable.label} saved to: {output_path}")
+                    results.append(("Completed", output_path, processed_stats))
+                except Exception as e:
+                    print(f"process_deliverables: {deliverable.label} failed: {str(e)}")
+                    results.append((f"Processing failed: {str(e)}", None, None))
+    return results, original_lufs, metrics.as_dict()
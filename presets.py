@@ -0,0 +1,26 @@
+import json
+import os
+
+PRESETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "presets")
+PRESET_KEYS = ("threshold", "ratio", "attack", "release", "peak_limit_target", "limiter_lookahead", "limiter_release")
+
+
+def get_available_presets():
+    if not os.path.isdir(PRESETS_DIR):
+        return []
+    return [f.replace(".json", "") for f in os.listdir(PRESETS_DIR) if f.endswith(".json")]
+
+
+def preset_path(preset_name):
+    return os.path.join(PRESETS_DIR, f"{preset_name}.json")
+
+
+def read_preset(preset_name):
+    with open(preset_path(preset_name), "r") as f:
+        return json.load(f)
+
+
+def write_preset(preset_name, preset_data):
+    os.makedirs(PRESETS_DIR, exist_ok=True)
+    with open(preset_path(preset_name), "w") as f:
+        json.dump(preset_data, f, indent=4)
@@ -0,0 +1,346 @@
+import math
+import os
+import queue
+import subprocess
+import threading
+import numpy as np
+from pydub.utils import get_encoder_name, mediainfo_json
+from compressor import Compressor
+from instrumentation import count, set_audio_seconds, stage
+from limiter import DEFAULT_LOOKAHEAD, DEFAULT_RELEASE, Limiter, limiter_makeup_gain
+from meter import RELATIVE_GATE, STEP_SECONDS, LoudnessMeter, power_to_lufs
+from wavfile import WavReader, WavWriter
+
+# Length of the blocks read, processed and written in streaming mode.
+STREAM_BLOCK_SECONDS = 10.0
+# Inputs whose decoded float32 size exceeds this are processed in streaming
+# mode instead of being decoded whole.
+STREAMING_THRESHOLD_BYTES = int(os.environ.get("LOUDV1_STREAMING_MB", 1024)) * 1024 * 1024
+# ffmpeg muxer names for output formats whose name is not a muxer.
+FFMPEG_FORMATS = {"aac": "adts"}
+# Blocks an EncoderWriter queues ahead of the encoder before `write` waits.
+ENCODER_QUEUE_BLOCKS = 4
+# Quick loudness estimates measure ESTIMATE_FRACTION of the input, in segments
+# of ESTIMATE_SEGMENT_SECONDS spread evenly over the file. Each segment is
+# preceded by a pre-roll so the K-weighting filters have settled.
+ESTIMATE_FRACTION = 0.1
+ESTIMATE_SEGMENT_SECONDS = 3.0
+ESTIMATE_PREROLL_SECONDS = 0.4
+ESTIMATE_MIN_SEGMENTS = 8
+ESTIMATE_MAX_SEGMENTS = 200
+# z-score of the reported error bound (95% confidence)
+ESTIMATE_CONFIDENCE_Z = 1.96
+
+
+def ffmpeg_format(output_format):
+    return FFMPEG_FORMATS.get(output_format.lower(), output_format.lower())
+
+
+class AudioInfo:
+    def __init__(self, frame_rate, channels, sample_width, frame_count):
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.frame_count = frame_count
+
+    @property
+    def duration_seconds(self):
+        return self.frame_count / self.frame_rate if self.frame_rate else 0.0
+
+    @property
+    def decoded_bytes(self):
+        return self.frame_count * self.channels * 4
+
+
+def probe_audio(path):
+    """Read format and length from the file header without decoding it."""
+    try:
+        with WavReader(path) as reader:
+            return AudioInfo(reader.frame_rate, reader.channels, reader.sample_width, reader.frame_count)
+    except Exception:
+        pass
+    info = mediainfo_json(path)
+    stream = next(s for s in info["streams"] if s["codec_type"] == "audio")
+    frame_rate = int(stream["sample_rate"])
+    bits = int(stream.get("bits_per_sample") or 0)
+    sample_width = bits // 8 if bits // 8 in (1, 2, 3, 4) else 2
+    duration = float(stream.get("duration") or info["format"].get("duration") or 0.0)
+    return AudioInfo(frame_rate, int(stream["channels"]), sample_width, int(round(duration * frame_rate)))
+
+
+def read_blocks(path, info, block_frames):
+    """Yield float32 (frames, channels) blocks of the decoded input."""
+    try:
+        reader = WavReader(path)
+    except Exception:
+        reader = None
+    if reader is not None:
+        with reader:
+            for block in reader.blocks(block_frames):
+                count("bytes_decoded", block.nbytes)
+                yield block
+        return
+
+    command = [get_encoder_name(), "-v", "error", "-i", path, "-vn", "-f", "f32le", "-acodec", "pcm_f32le",
+               "-ac", str(info.channels), "-ar", str(info.frame_rate), "-"]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    frame_bytes = info.channels * 4
+    try:
+        while True:
+            raw = process.stdout.read(block_frames * frame_bytes)
+            if not raw:
+                break
+            raw = raw[:len(raw) - len(raw) % frame_bytes]
+            count("bytes_decoded", len(raw))
+            yield np.frombuffer(raw, dtype="<f4").reshape(-1, info.channels)
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.stderr.close()
+        if process.wait() != 0 and stderr:
+            raise RuntimeError(f"Decoding failed: {stderr.decode('utf-8', 'ignore').strip()}")
+
+
+def read_segment(path, info, start_frame, frames):
+    """Decode `frames` frames starting at `start_frame` as float32 (frames, channels)."""
+    try:
+        reader = WavReader(path)
+    except Exception:
+        reader = None
+    if reader is not None:
+        with reader:
+            reader.seek(start_frame)
+            return reader.read(frames)
+
+    command = [get_encoder_name(), "-v", "error", "-ss", f"{start_frame / info.frame_rate:.6f}", "-i", path,
+               "-vn", "-t", f"{frames / info.frame_rate:.6f}", "-f", "f32le", "-acodec", "pcm_f32le",
+               "-ac", str(info.channels), "-ar", str(info.frame_rate), "-"]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"Decoding failed: {result.stderr.decode('utf-8', 'ignore').strip()}")
+    frame_bytes = info.channels * 4
+    raw = result.stdout[:frames * frame_bytes]
+    raw = raw[:len(raw) - len(raw) % frame_bytes]
+    return np.frombuffer(raw, dtype="<f4").reshape(-1, info.channels)
+
+
+def measure_lufs(path, info=None, block_seconds=STREAM_BLOCK_SECONDS):
+    """Integrated loudness of the whole input, decoded block by block."""
+    info = info or probe_audio(path)
+    meter = LoudnessMeter(info.frame_rate, info.channels)
+    for block in read_blocks(path, info, max(1, int(block_seconds * info.frame_rate))):
+        meter.process(block)
+    return meter.integrated_loudness()
+
+
+def estimate_lufs(path, sample_fraction=ESTIMATE_FRACTION, segment_seconds=ESTIMATE_SEGMENT_SECONDS):
+    """Estimate integrated loudness from a sample of the gating blocks.
+
+    Measures evenly spaced segments covering about `sample_fraction` of the
+    input (systematic sampling with a random start) and applies the BS.1770
+    gates to the sampled blocks. Returns (lufs, error_bound): the bound is the
+    half-width in LU of the 95% confidence interval, from the between-segment
+    variance of the gated power (ratio estimator). Inputs too short to sample
+    are measured in full and reported with a bound of 0.
+    """
+    info = probe_audio(path)
+    segment_frames = max(1, int(segment_seconds * info.frame_rate))
+    total_segments = info.frame_count // segment_frames
+    segment_count = min(max(ESTIMATE_MIN_SEGMENTS, math.ceil(sample_fraction * total_segments)), ESTIMATE_MAX_SEGMENTS)
+    if segment_count * 2 > total_segments:
+        return measure_lufs(path, info), 0.0
+
+    rng = np.random.default_rng()
+    segments = ((np.arange(segment_count) + rng.random()) * (total_segments / segment_count)).astype(np.int64)
+    block_powers = []
+    for segment in segments:
+        meter = LoudnessMeter(info.frame_rate, info.channels)
+        start = int(segment) * segment_frames
+        preroll = min(start, meter.step_frames * int(round(ESTIMATE_PREROLL_SECONDS / STEP_SECONDS)))
+        samples = read_segment(path, info, start - preroll, preroll + segment_frames)
+        meter.process(samples[:preroll])
+        meter.reset_gating()
+        meter.process(samples[preroll:])
+        block_powers.append(meter.block_powers())
+
+    gated = np.concatenate(block_powers)
+    if not len(gated):
+        return -float("inf"), 0.0
+    relative_gate = power_to_lufs(gated.mean()) + RELATIVE_GATE
+    sums = np.array([powers[power_to_lufs(powers) > relative_gate].sum() for powers in block_powers])
+    counts = np.array([np.count_nonzero(power_to_lufs(powers) > relative_gate) for powers in block_powers])
+    if not counts.sum():
+        return -float("inf"), 0.0
+    ratio = sums.sum() / counts.sum()
+    residuals = sums - ratio * counts
+    finite_population = 1.0 - segment_count / total_segments
+    standard_error = math.sqrt(finite_population * residuals.var(ddof=1) / segment_count) / counts.mean()
+    relative_error = ESTIMATE_CONFIDENCE_Z * standard_error / ratio
+    error_bound = -10.0 * math.log10(1.0 - relative_error) if relative_error < 1.0 else float("inf")
+    return float(power_to_lufs(ratio)), error_bound
+
+
+class EncoderWriter:
+    """Pipes float32 blocks into an ffmpeg process that encodes the output file.
+
+    Blocks are fed to the encoder from a background thread, so `write` returns
+    as soon as a block is queued and the caller's DSP on the next block runs
+    while ffmpeg encodes the previous ones. A queued block is referenced, not
+    copied, until it has been piped, so it must not be modified after `write`.
+    As with wavfile.WavWriter, the output is renamed to `path` on `close`.
+    """
+
+    def __init__(self, path, output_format, frame_rate, channels):
+        self.path = path
+        self.channels = channels
+        self._temp_path = f"{path}.{os.getpid()}.tmp"
+        command = [get_encoder_name(), "-y", "-v", "error", "-f", "f32le", "-ar", str(frame_rate),
+                   "-ac", str(channels), "-i", "-", "-f", ffmpeg_format(output_format), self._temp_path]
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        self._queue = queue.Queue(maxsize=ENCODER_QUEUE_BLOCKS)
+        self._feeder = threading.Thread(target=self._feed, daemon=True)
+        self._feeder.start()
+        self._result = None
+
+    def _feed(self):
+        # Keeps draining the queue after a failed write so `write` never
+        # blocks on a dead encoder; the failure is reported by `close`.
+        failed = False
+        while True:
+            block = self._queue.get()
+            if block is None:
+                break
+            if not failed:
+                try:
+                    self._process.stdin.write(block)
+                except OSError:
+                    failed = True
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+
+    def write(self, samples):
+        self._queue.put(np.ascontiguousarray(samples, dtype="<f4"))
+
+    def _finish(self):
+        if self._result is None:
+            if self._feeder.is_alive():
+                self._queue.put(None)
+                self._feeder.join()
+            stderr = self._process.stderr.read()
+            self._process.stderr.close()
+            self._result = self._process.wait(), stderr
+        return self._result
+
+    def close(self):
+        # as wavfile.WavWriter.close, closing twice does nothing
+        if self._result is not None:
+            return
+        returncode, stderr = self._finish()
+        if returncode != 0:
+            if os.path.exists(self._temp_path):
+                os.remove(self._temp_path)
+            raise RuntimeError(f"Encoding failed: {stderr.decode('utf-8', 'ignore').strip()}")
+        os.replace(self._temp_path, self.path)
+
+    def discard(self):
+        """Stop the encoder and abandon the output, leaving `path` untouched."""
+        self._process.kill()
+        self._finish()
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def should_stream(path):
+    try:
+        return probe_audio(path).decoded_bytes > STREAMING_THRESHOLD_BYTES
+    except Exception:
+        return False
+
+
+def open_writer(path, output_format, info):
+    if output_format.lower() == "wav":
+        return WavWriter(path, info.frame_rate, info.channels, info.sample_width)
+    return EncoderWriter(path, output_format, info.frame_rate, info.channels)
+
+
+def normalize_gain(meter, target_loudness):
+    """Gain in dB that brings the metered loudness to target_loudness.
+
+    Raises ValueError for audio shorter than one gating block or entirely
+    below the absolute gate, whose loudness is -inf.
+    """
+    loudness = meter.integrated_loudness()
+    if not math.isfinite(loudness):
+        raise ValueError("Audio is too short or too quiet to measure its loudness")
+    return target_loudness - loudness
+
+
+def process_streaming(input_path, output_path, output_format, target_loudness, threshold, ratio, attack, release,
+                      peak_limit_target, limiter_lookahead=DEFAULT_LOOKAHEAD, limiter_release=DEFAULT_RELEASE,
+                      block_seconds=STREAM_BLOCK_SECONDS, measure_original=False):
+    """Two-pass, bounded-memory version of pipeline.load_compressed and pipeline.render_audio.
+
+    The first pass compresses the input block by block and measures its peak
+    and integrated loudness; the second pass repeats the (deterministic)
+    compression, applies the resulting gain and the look-ahead limiter and
+    writes each block straight to `output_path`. When the limiter will engage,
+    trial passes in between measure the loudness it takes away, as in
+    pipeline.render_audio. Returns (original_lufs, processed_stats), with original_lufs
+    measured in the first pass only when `measure_original` is set and
+    processed_stats the meter.LoudnessMeter.stats dict of the output.
+    """
+    info = probe_audio(input_path)
+    set_audio_seconds(info.duration_seconds)
+    block_frames = max(1, int(block_seconds * info.frame_rate))
+
+    compressor = Compressor(info.frame_rate, threshold, ratio, attack, release)
+    meter = LoudnessMeter(info.frame_rate, info.channels)
+    original_meter = LoudnessMeter(info.frame_rate, info.channels) if measure_original else None
+    with stage("analysis_pass"):
+        for block in read_blocks(input_path, info, block_frames):
+            if original_meter:
+                original_meter.process(block)
+            meter.process(compressor.process(block))
+
+    gain_db = normalize_gain(meter, target_loudness)
+    # the limiter only runs when it can engage
+    limit = meter.true_peak_dbtp + gain_db > peak_limit_target
+    if limit:
+        def compressed_blocks():
+            compressor.reset()
+            for block in read_blocks(input_path, info, block_frames):
+                yield compressor.process(block)
+
+        with stage("limiter_makeup"):
+            gain_db += limiter_makeup_gain(compressed_blocks, info.frame_rate, info.channels, gain_db, target_loudness, peak_limit_target,
+                                           limiter_lookahead, limiter_release)
+    gain = np.float32(10 ** (gain_db / 20))
+
+    compressor.reset()
+    limiter = Limiter(info.frame_rate, info.channels, peak_limit_target, limiter_lookahead, limiter_release) if limit else None
+    output_meter = LoudnessMeter(info.frame_rate, info.channels)
+    with stage("render_pass"), open_writer(output_path, output_format, info) as writer:
+        for block in read_blocks(input_path, info, block_frames):
+            block = compressor.process(block)
+            block *= gain
+            if limiter:
+                block = limiter.process(block)
+            output_meter.process(block)
+            writer.write(block)
+        if limiter:
+            block = limiter.flush()
+            output_meter.process(block)
+            writer.write(block)
+    original_lufs = original_meter.integrated_loudness() if original_meter else None
+    return original_lufs, output_meter.stats()
@@ -0,0 +1,163 @@
+import os
+import struct
+from pcm import float_to_pcm, pcm_to_float
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+# Largest data chunk a plain RIFF header can describe; longer files are
+# finalized as RF64 (EBU Tech 3306).
+RIFF_MAX_SIZE = 0xFFFFFFFF
+
+
+class WavReader:
+    """Reads a RIFF/RF64 WAV file block by block without loading it whole."""
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        try:
+            self._read_header()
+        except Exception:
+            self._file.close()
+            raise
+
+    def _read_header(self):
+        riff, size, wave = struct.unpack("<4sI4s", self._file.read(12))
+        if riff not in (b"RIFF", b"RF64") or wave != b"WAVE":
+            raise ValueError("Not a WAV file")
+        data_size_64 = None
+        fmt = None
+        while True:
+            header = self._file.read(8)
+            if len(header) < 8:
+                raise ValueError("WAV file has no data chunk")
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"ds64":
+                body = self._file.read(chunk_size)
+                data_size_64 = struct.unpack("<Q", body[8:16])[0]
+            elif chunk_id == b"fmt ":
+                fmt = self._file.read(chunk_size)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError("WAV data chunk before fmt chunk")
+                if data_size_64 is not None and chunk_size == RIFF_MAX_SIZE:
+                    chunk_size = data_size_64
+                break
+            else:
+                self._file.seek(chunk_size, 1)
+            if chunk_size % 2:
+                self._file.seek(1, 1)
+
+        format_tag, self.channels, self.frame_rate, _, block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+        if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+            format_tag = struct.unpack("<H", fmt[24:26])[0]
+        if format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+            raise ValueError(f"Unsupported WAV format tag: {format_tag:#x}")
+        self.float_format = format_tag == WAVE_FORMAT_IEEE_FLOAT
+        self.sample_width = bits // 8
+        self.frame_width = block_align
+        self.frame_count = chunk_size // block_align
+        self._data_offset = self._file.tell()
+        self._remaining = self.frame_count
+
+    def seek(self, frame):
+        frame = min(max(0, frame), self.frame_count)
+        self._file.seek(self._data_offset + frame * self.frame_width)
+        self._remaining = self.frame_count - frame
+
+    def read(self, frames):
+        frames = min(frames, self._remaining)
+        raw = self._file.read(frames * self.frame_width)
+        frames = len(raw) // self.frame_width
+        self._remaining -= frames
+        return pcm_to_float(raw[:frames * self.frame_width], self.sample_width, self.channels, self.float_format)
+
+    def blocks(self, frames):
+        while self._remaining:
+            block = self.read(frames)
+            if not len(block):
+                break
+            yield block
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class WavWriter:
+    """Writes integer PCM WAV incrementally from float32 (frames, channels) blocks.
+
+    A JUNK chunk reserves room for an RF64 ds64 chunk, so output larger than
+    4 GiB is finalized as RF64 in place instead of being truncated. Blocks are
+    converted into one reused PCM buffer and written straight to disk. The file
+    is written under a temporary name and renamed to `path` by `close`, so an
+    existing file at `path` is replaced atomically and never truncated (it may
+    be a hard link to a cache entry).
+    """
+
+    def __init__(self, path, frame_rate, channels, sample_width):
+        self.path = path
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.data_size = 0
+        self._buffer = bytearray()
+        self._temp_path = f"{path}.{os.getpid()}.tmp"
+        self._file = open(self._temp_path, "wb")
+        byte_rate = frame_rate * channels * sample_width
+        self._file.write(struct.pack("<4sI4s", b"RIFF", 0, b"WAVE"))
+        self._file.write(struct.pack("<4sI", b"JUNK", 28) + bytes(28))
+        self._file.write(struct.pack("<4sIHHIIHH", b"fmt ", 16, WAVE_FORMAT_PCM, channels, frame_rate,
+                                     byte_rate, channels * sample_width, sample_width * 8))
+        self._file.write(struct.pack("<4sI", b"data", 0))
+        self._data_offset = self._file.tell()
+
+    def write(self, samples):
+        size = samples.size * self.sample_width
+        if len(self._buffer) < size:
+            self._buffer = bytearray(size)
+        raw = memoryview(self._buffer)[:size]
+        float_to_pcm(samples, self.sample_width, out=raw)
+        self._file.write(raw)
+        self.data_size += size
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self.data_size % 2:
+            self._file.write(b"\x00")
+        riff_size = self._file.tell() - 8
+        if riff_size <= RIFF_MAX_SIZE:
+            self._file.seek(4)
+            self._file.write(struct.pack("<I", riff_size))
+            self._file.seek(self._data_offset - 4)
+            self._file.write(struct.pack("<I", self.data_size))
+        else:
+            frames = self.data_size // (self.channels * self.sample_width)
+            self._file.seek(0)
+            self._file.write(struct.pack("<4sI4s", b"RF64", RIFF_MAX_SIZE, b"WAVE"))
+            self._file.write(struct.pack("<4sIQQQI", b"ds64", 28, riff_size, self.data_size, frames, 0))
+            self._file.seek(self._data_offset - 4)
+            self._file.write(struct.pack("<I", RIFF_MAX_SIZE))
+        self._file.close()
+        os.replace(self._temp_path, self.path)
+
+    def discard(self):
+        """Abandon the output, leaving `path` untouched."""
+        if not self._file.closed:
+            self._file.close()
+            os.remove(self._temp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()